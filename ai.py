@@ -2,34 +2,99 @@ import math
 import random
 import time
 
-from enums import PlayerColor
-from transpositions import TranspositionTable, EvalType
+from core import MATE_SCORE, INFINITE_SCORE, is_mate_score
+from enums import PlayerColor, PieceType
+from evaluation import Evaluator
+from move import NullMove
+from move_ordering import MoveOrdering, is_quiet
+from parallel_search import LazySMP
+from transpositions import TranspositionTable, EvalType, SharedTranspositionTable, DEFAULT_TABLE_MB
+
+# half-width of the root search window around the previous iteration's score, in centipawns
+ASPIRATION_WINDOW = 50
+# extra depth skipped when searching the reply to a null move
+NULL_MOVE_REDUCTION = 2
+# quiet moves ordered after this many moves are searched with reduced depth
+LATE_MOVE_INDEX = 3
+LATE_MOVE_MIN_DEPTH = 3
+LATE_MOVE_REDUCTION = 1
+# captures in quiescence are skipped if winning the captured piece plus this much still can't reach alpha
+DELTA_MARGIN = 200
 
 
 class AI:
-  def __init__(self, search_depth, game_state):
+  def __init__(self, search_depth, game_state, movetime=None, max_nodes=None, threads=1, hash_mb=DEFAULT_TABLE_MB,
+      table_buffer=None):
     self.search_depth = search_depth
     self.game_state = game_state
-    self.transposition_table = TranspositionTable()
+    self.movetime = movetime
+    self.max_nodes = max_nodes
+    self.threads = threads
+    self.use_pvs = True
+    self.aspiration_window = ASPIRATION_WINDOW
+    self.use_null_move = True
+    self.use_lmr = True
+    self.use_quiescence_pruning = True
+    # parallel searches share one table through shared memory, which is the only way they talk to each other. helpers
+    # are handed the main search's buffer instead of allocating their own
+    if table_buffer is not None:
+      self.transposition_table = SharedTranspositionTable(game_state, buffer=table_buffer)
+    else:
+      table_class = SharedTranspositionTable if threads > 1 else TranspositionTable
+      self.transposition_table = table_class(game_state, hash_mb)
+    self.move_ordering = MoveOrdering(game_state)
+    self.evaluator = Evaluator(game_state)
     self.n_moves_searched = 0
+    self.n_quiescence_moves = 0
+    self.deadline = None
+    self.node_limit = None
+    self.completed_depth = 0
+    self.stopped = False
+    # set by another process to stop a parallel search
+    self.shared_stop = None
+    self.print_iterations = True
 
   def evaluate_board(self, active_player_color):
-    return (1 if active_player_color is PlayerColor.WHITE else -1) * self.game_state.board.evaluation
+    return (1 if active_player_color is PlayerColor.WHITE else -1) * self.evaluator.evaluate()
+
+  def out_of_budget(self):
+    if self.stopped:
+      return True
+    if self.shared_stop is not None and self.shared_stop.value:
+      self.stopped = True
+      return True
+    # always finish the first iteration, so we have a move to play
+    if self.completed_depth == 0:
+      return False
+    if self.node_limit is not None and self.n_moves_searched >= self.node_limit:
+      self.stopped = True
+    elif self.deadline is not None and time.time() >= self.deadline:
+      self.stopped = True
+    return self.stopped
 
   def quiesce(self, active_player_color, alpha, beta):
-    score = self.evaluate_board(active_player_color)
-    if score >= beta:
+    if self.out_of_budget():
+      return None, 0
+    stand_pat = self.evaluate_board(active_player_color)
+    if stand_pat >= beta:
       return None, beta
-    alpha = max(alpha, score)
+    alpha = max(alpha, stand_pat)
     moves = self.game_state.generate_all_legal_moves(active_player_color, filter_checks=True, captures_only=True)
     top_move = None
     for move in moves:
+      if self.prune_capture(move, stand_pat, alpha):
+        continue
       self.n_moves_searched += 1
-      move.apply()
+      self.n_quiescence_moves += 1
+      move.make()
+      self.move_ordering.push(move)
       _, score = self.quiesce(active_player_color.opponent, -beta, -alpha)
       # negate score to reflect opponent's perspective
       score = -score
-      move.unapply()
+      self.move_ordering.pop()
+      move.unmake()
+      if self.stopped:
+        return None, 0
       if score >= beta:
         # beta limit tells us opponent can prevent this scenario
         return None, beta
@@ -38,40 +103,179 @@ class AI:
         alpha = score
     return top_move, alpha
 
-  def search_moves(self, active_player_color, depth, alpha, beta):
-    if entry := self.transposition_table.lookup(self.game_state.board.zobrist_key, depth, alpha, beta):
-      return entry.move, entry.score
-    if depth == 0:
+  def prune_capture(self, move, stand_pat, alpha):
+    if not self.use_quiescence_pruning or move.promote_type:
+      return False
+    # delta pruning: even winning the captured piece for free leaves us below alpha
+    if stand_pat + move.captured_piece.type.score + DELTA_MARGIN <= alpha:
+      return True
+    # no point chasing a capture that loses material once the recaptures are played out
+    return self.game_state.move_generator.is_bad_capture(move)
+
+  def has_non_pawn_material(self, player_color):
+    player = self.game_state.players[player_color]
+    return any(player.pieces.count(piece_type) for piece_type in [PieceType.KNIGHT, PieceType.BISHOP, PieceType.ROOK,
+      PieceType.QUEEN])
+
+  def can_try_null_move(self, active_player_color, depth, beta, allow_null_move, in_check):
+    if not self.use_null_move or not allow_null_move or in_check or self.move_ordering.ply() == 0:
+      return False
+    if depth <= NULL_MOVE_REDUCTION or is_mate_score(beta):
+      return False
+    # with only pawns left, passing can be better than any real move (zugzwang), so a null move proves nothing
+    if not self.has_non_pawn_material(active_player_color):
+      return False
+    return self.evaluate_board(active_player_color) >= beta
+
+  def null_move_cutoff(self, active_player_color, depth, beta):
+    # if we can pass and still beat beta, a real move would almost certainly beat it too
+    null_move = NullMove(self.game_state)
+    null_move.make()
+    self.move_ordering.push(None)
+    _, score = self.search_moves(active_player_color.opponent, depth - 1 - NULL_MOVE_REDUCTION, -beta, -beta + 1,
+      allow_null_move=False)
+    self.move_ordering.pop()
+    null_move.unmake()
+    return not self.stopped and -score >= beta
+
+  def late_move_reduction(self, move, move_index, depth, in_check, alpha):
+    if not self.use_lmr or in_check or move_index < LATE_MOVE_INDEX or depth < LATE_MOVE_MIN_DEPTH:
+      return 0
+    if not is_quiet(move) or is_mate_score(alpha):
+      return 0
+    # don't reduce checks
+    if self.game_state.players[move.piece.player_color.opponent].in_check():
+      return 0
+    return LATE_MOVE_REDUCTION
+
+  def full_depth_score(self, active_player_color, depth, alpha, beta, move_index):
+    if self.use_pvs and move_index > 0 and not is_mate_score(alpha):
+      # assume the first move is best, and just prove this one can't beat it with a null window
+      _, score = self.search_moves(active_player_color.opponent, depth - 1, -alpha - 1, -alpha)
+      score = -score
+      if alpha < score < beta:
+        # proof failed, so we need the real score
+        _, score = self.search_moves(active_player_color.opponent, depth - 1, -beta, -alpha)
+        score = -score
+      return score
+    _, score = self.search_moves(active_player_color.opponent, depth - 1, -beta, -alpha)
+    # negate score to reflect opponent's perspective
+    return -score
+
+  def search_moves(self, active_player_color, depth, alpha, beta, allow_null_move=True):
+    if self.out_of_budget():
+      return None, 0
+    ply = self.move_ordering.ply()
+    if ply > 0:
+      if self.game_state.is_draw():
+        # shuffling back into an earlier position or running out the fifty-move clock can't gain anything
+        return None, 0
+      # mate distance pruning: nothing here can beat mating right now, or do worse than being mated right now
+      alpha = max(alpha, -MATE_SCORE + ply)
+      beta = min(beta, MATE_SCORE - ply - 1)
+      if alpha >= beta:
+        return None, alpha
+    entry = self.transposition_table.lookup(self.game_state.board.zobrist_key, depth, alpha, beta, ply)
+    # the root needs a move to play, which only an exact entry is sure to have
+    if entry and (ply > 0 or entry.eval_type is EvalType.EXACT):
+      return entry.move if ply == 0 else None, entry.score
+    if depth <= 0:
       return self.quiesce(active_player_color, alpha, beta)
-    moves = self.game_state.generate_all_legal_moves(active_player_color, filter_checks=True)
-    if not moves:
-      if self.game_state.active_player().in_check():
-        return None, -math.inf
-      else:
+    in_check = self.game_state.players[active_player_color].in_check()
+    if self.can_try_null_move(active_player_color, depth, beta, allow_null_move, in_check):
+      if self.null_move_cutoff(active_player_color, depth, beta):
+        return None, beta
+      if self.stopped:
         return None, 0
     top_move = None
     eval_type = EvalType.UPPER_BOUND
-    for move in moves:
+    move_index = -1
+    for move_index, move in enumerate(self.game_state.generate_staged_moves(active_player_color)):
       self.n_moves_searched += 1
-      move.apply()
-      _, score = self.search_moves(active_player_color.opponent, depth - 1, -beta, -alpha)
-      # negate score to reflect opponent's perspective
-      score = -score
-      move.unapply()
+      move.make()
+      self.move_ordering.push(move)
+      if reduction := self.late_move_reduction(move, move_index, depth, in_check, alpha):
+        _, score = self.search_moves(active_player_color.opponent, depth - 1 - reduction, -alpha - 1, -alpha)
+        score = -score
+        if score > alpha:
+          # reduced search thinks the move is better than we expected, so confirm it at full depth
+          score = self.full_depth_score(active_player_color, depth, alpha, beta, move_index)
+      else:
+        score = self.full_depth_score(active_player_color, depth, alpha, beta, move_index)
+      self.move_ordering.pop()
+      move.unmake()
+      if self.stopped:
+        # unfinished search results are unreliable, so don't store them
+        return None, 0
       if score >= beta:
+        self.move_ordering.record_cutoff(move, depth, move_index)
         self.transposition_table.store(self.game_state.board.zobrist_key, depth, beta,
-          EvalType.LOWER_BOUND, move)
+          EvalType.LOWER_BOUND, move, ply)
         # beta limit tells us opponent can prevent this scenario
         return None, beta
       if score > alpha:
         eval_type = EvalType.EXACT
         top_move = move
         alpha = score
-    self.transposition_table.store(self.game_state.board.zobrist_key, depth, alpha, eval_type, top_move)
+    if move_index < 0:
+      # no legal moves, and being mated sooner is worse
+      return None, -MATE_SCORE + ply if in_check else 0
+    self.transposition_table.store(self.game_state.board.zobrist_key, depth, alpha, eval_type, top_move, ply)
     return top_move, alpha
 
-  def best_move(self):
+  def aspiration_search(self, depth, previous_score):
+    if not self.aspiration_window or previous_score is None or is_mate_score(previous_score):
+      return self.search_moves(self.game_state.active_player_color, depth, -INFINITE_SCORE, INFINITE_SCORE)
+    window = self.aspiration_window
+    alpha, beta = previous_score - window, previous_score + window
+    while True:
+      move, score = self.search_moves(self.game_state.active_player_color, depth, alpha, beta)
+      if self.stopped:
+        return move, score
+      if score <= alpha:
+        # failed low, so widen the window downward and search again
+        window *= 4
+        alpha = previous_score - window if window < 16 * self.aspiration_window else -INFINITE_SCORE
+      elif score >= beta:
+        window *= 4
+        beta = previous_score + window if window < 16 * self.aspiration_window else INFINITE_SCORE
+      else:
+        return move, score
+
+  def iterative_deepening(self, movetime=None, max_nodes=None, deadline=None, first_depth=1, on_iteration=None):
+    start_time = time.time()
+    movetime = movetime if movetime is not None else self.movetime
+    self.node_limit = max_nodes if max_nodes is not None else self.max_nodes
+    self.deadline = deadline
+    if movetime is not None:
+      self.deadline = min(self.deadline or math.inf, start_time + movetime)
+    self.completed_depth = 0
+    self.stopped = False
+    self.move_ordering.new_search()
+    best_move, best_score = None, None
+    for depth in range(first_depth, self.search_depth + 1):
+      # each iteration stores its best moves in the transposition table, which orders moves for the next one
+      move, score = self.aspiration_search(depth, best_score)
+      if self.stopped:
+        if self.print_iterations:
+          print(f"stopped searching at depth {depth} after {self.n_moves_searched} moves")
+        break
+      best_move, best_score = move, score
+      self.completed_depth = depth
+      if on_iteration:
+        on_iteration(depth, move, score)
+      elapsed = time.time() - start_time
+      if self.print_iterations:
+        print(f"finished depth {depth} with score {score} ({self.n_moves_searched} moves, {elapsed:.2f} seconds, "
+          f"{self.move_ordering.first_move_cutoff_rate():.1f}% first move cutoffs): {move}")
+      if self.deadline is not None and time.time() + elapsed > self.deadline:
+        # next iteration costs more than everything so far, so don't start one we can't finish
+        break
+    return best_move, best_score
+
+  def best_move(self, movetime=None, max_nodes=None, deadline=None):
     self.n_moves_searched = 0
+    self.transposition_table.new_search()
     print(f"\ncalculating {self.game_state.active_player_color} move ...")
     start_time = time.time()
     opening_moves = self.game_state.opening_moves()
@@ -79,9 +283,12 @@ class AI:
       move = random.choice(opening_moves)
       print(f"found opening move in book:\n\t{move}")
     else:
-      move, score = self.search_moves(self.game_state.active_player_color, self.search_depth, -math.inf, math.inf)
+      if self.threads > 1:
+        move, score = LazySMP(self, self.threads).search(movetime, max_nodes, deadline)
+      else:
+        move, score = self.iterative_deepening(movetime, max_nodes, deadline)
       print(
-        f"evaluated score {score} by searching {self.n_moves_searched} moves in {time.time() - start_time:.2f} seconds:\n\t{move}")
+        f"evaluated score {score} to depth {self.completed_depth} by searching {self.n_moves_searched} moves in {time.time() - start_time:.2f} seconds:\n\t{move}")
     if move:
       return move
     else:
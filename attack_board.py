@@ -1,82 +1,105 @@
+from bitboards import KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, bit_squares, rook_attacks, bishop_attacks, \
+  queen_attacks
 from core import empty_board_array
-from board import Board
 from enums import PieceType
-from move_generator import ROOK_DIRECTIONS, BISHOP_DIRECTIONS
 
 
 class AttackBoard:
+  # when set, every incremental update is checked against a full refresh
+  verify = False
+
   def __init__(self, player_state):
     self.player_state = player_state
     self.game_state = player_state.game_state
-    self.full_board = empty_board_array(False)
-    self.pawn_board = empty_board_array(False)
-
-  def __getitem__(self, item):
-    return self.full_board[item]
+    # how many of the player's pieces attack each square, counting squares their own pieces stand on
+    self.counts = empty_board_array(0)
+    self.pawn_counts = empty_board_array(0)
+    # squares each piece attacks, as a bitboard, so it can be taken back off the counts when the piece moves or is
+    # blocked
+    self.piece_attacks = dict()
 
-  def calculate_knight_attacks(self, knight):
-    for far_rank in [True, False]:
-      for rank_direction in [1, -1]:
-        for file_direction in [1, -1]:
-          rank = (2 if far_rank else 1) * rank_direction + knight.rank
-          file = (1 if far_rank else 2) * file_direction + knight.file
-          if self.empty_or_opponent_square(knight.player_color, rank, file):
-            self.full_board[rank][file] = True
+  def empty_or_opponent_square(self, rank, file):
+    piece_on_square = self.game_state.board[rank][file]
+    return not piece_on_square or piece_on_square.player_color is self.player_state.player_color.opponent
 
-  def empty_or_opponent_square(self, player_color, rank, file):
-    if Board.in_bounds(rank, file):
-      piece_on_square = self.game_state.board[rank][file]
-      return not piece_on_square or piece_on_square.player_color is player_color.opponent
-    return False
+  def attacks(self, rank, file):
+    return self.counts[rank][file] > 0 and self.empty_or_opponent_square(rank, file)
 
-  def calculate_king_attacks(self, king):
-    for rank_direction, file_direction in ROOK_DIRECTIONS + BISHOP_DIRECTIONS:
-      rank = rank_direction + king.rank
-      file = file_direction + king.file
-      if self.empty_or_opponent_square(king.player_color, rank, file):
-        self.full_board[rank][file] = True
+  def pawn_attacks(self, rank, file):
+    return self.pawn_counts[rank][file] > 0 and self.empty_or_opponent_square(rank, file)
 
   def calculate_attacks(self, piece):
+    # as a bitboard, where slider attacks include the first piece they hit, whoever it belongs to
+    square = piece.rank * 8 + piece.file
     if piece.type is PieceType.PAWN:
-      self.calculate_pawn_attacks(piece)
+      return PAWN_ATTACKS[piece.player_color][square]
     elif piece.type is PieceType.KNIGHT:
-      self.calculate_knight_attacks(piece)
+      return KNIGHT_ATTACKS[square]
     elif piece.type is PieceType.BISHOP:
-      self.calculate_slide_attacks(piece, BISHOP_DIRECTIONS)
+      return bishop_attacks(square, self.game_state.board.bitboards.all_occupancy())
     elif piece.type is PieceType.ROOK:
-      self.calculate_slide_attacks(piece, ROOK_DIRECTIONS)
+      return rook_attacks(square, self.game_state.board.bitboards.all_occupancy())
     elif piece.type is PieceType.QUEEN:
-      self.calculate_slide_attacks(piece, ROOK_DIRECTIONS + BISHOP_DIRECTIONS)
+      return queen_attacks(square, self.game_state.board.bitboards.all_occupancy())
     else:  # piece.type is PieceType.KING:
-      self.calculate_king_attacks(piece)
+      return KING_ATTACKS[square]
 
-  def calculate_slide_attacks(self, piece, directions):
-    for rank_direction, file_direction in directions:
-      collision = False
-      distance = 1
-      while not collision:
-        rank = distance * rank_direction + piece.rank
-        file = distance * file_direction + piece.file
-        if not Board.in_bounds(rank, file):
-          collision = True
-        else:
-          if self.empty_or_opponent_square(piece.player_color, rank, file):
-            self.full_board[rank][file] = True
-          if self.game_state.board[rank][file]:
-            collision = True
-        distance += 1
+  def add_piece(self, piece):
+    attacks = self.calculate_attacks(piece)
+    self.piece_attacks[piece] = (attacks, piece.type)
+    for square in bit_squares(attacks):
+      rank, file = divmod(square, 8)
+      self.counts[rank][file] += 1
+      if piece.type is PieceType.PAWN:
+        self.pawn_counts[rank][file] += 1
 
-  def calculate_pawn_attacks(self, pawn):
-    pawn_direction = pawn.player_color.pawn_direction
-    rank = pawn.rank + pawn_direction
-    for file in [pawn.file + 1, pawn.file - 1]:
-      if self.empty_or_opponent_square(pawn.player_color, rank, file):
-        self.full_board[rank][file] = True
-        self.pawn_board[rank][file] = True
+  def remove_piece(self, piece):
+    attacks, piece_type = self.piece_attacks.pop(piece)
+    for square in bit_squares(attacks):
+      rank, file = divmod(square, 8)
+      self.counts[rank][file] -= 1
+      if piece_type is PieceType.PAWN:
+        self.pawn_counts[rank][file] -= 1
 
   def refresh(self):
-    self.full_board = empty_board_array(False)
-    self.pawn_board = empty_board_array(False)
+    self.counts = empty_board_array(0)
+    self.pawn_counts = empty_board_array(0)
+    self.piece_attacks = dict()
     for piece in self.player_state.all_pieces():
-      self.calculate_attacks(piece)
+      self.add_piece(piece)
+
+  def update(self, move):
+    # only pieces whose attacks reach a square the move emptied or filled can change, along with the pieces the move
+    # itself moved, captured or restored
+    touched_squares = (1 << (move.old_rank * 8 + move.old_file)) | (1 << (move.rank * 8 + move.file))
+    affected_pieces = set()
+    if rook_move := move.castling_rook_move:
+      touched_squares |= (1 << (rook_move.old_rank * 8 + rook_move.old_file)) | \
+        (1 << (rook_move.rank * 8 + rook_move.file))
+      if rook_move.piece.player_color is self.player_state.player_color:
+        affected_pieces.add(rook_move.piece)
+    if move.captured_piece:
+      touched_squares |= 1 << (move.captured_piece.rank * 8 + move.captured_piece.file)
+      if move.captured_piece.player_color is self.player_state.player_color:
+        affected_pieces.add(move.captured_piece)
+    if move.piece.player_color is self.player_state.player_color:
+      affected_pieces.add(move.piece)
+    for piece, (attacks, _) in self.piece_attacks.items():
+      if touched_squares & attacks:
+        affected_pieces.add(piece)
+    board = self.game_state.board
+    for piece in affected_pieces:
+      if piece in self.piece_attacks:
+        self.remove_piece(piece)
+      if board[piece.rank][piece.file] is piece:
+        self.add_piece(piece)
+    if AttackBoard.verify:
+      self.check_against_refresh()
 
+  def check_against_refresh(self):
+    counts, pawn_counts = self.counts, self.pawn_counts
+    piece_attacks = self.piece_attacks
+    self.refresh()
+    assert (counts, pawn_counts) == (self.counts, self.pawn_counts), \
+      f"incremental {self.player_state.player_color} attack board doesn't match a full refresh"
+    self.piece_attacks = piece_attacks
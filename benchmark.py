@@ -0,0 +1,231 @@
+import os
+import random
+import time
+from argparse import ArgumentParser
+
+from ai import ASPIRATION_WINDOW
+from attack_board import AttackBoard
+from bitboards import bit_squares
+from board import Board
+from core import ROOK_DIRECTIONS, BISHOP_DIRECTIONS, KING_OFFSETS, KNIGHT_OFFSETS
+from enums import PlayerType, PieceType
+from game_state import GameState, START_FEN
+
+BENCHMARK_FENS = [
+  START_FEN,
+  "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+  "r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP1B1PPP/R2QKB1R w KQ - 0 1",
+]
+
+# AI attributes to override for each search configuration we compare
+SEARCH_MODES = {
+  "alpha-beta": dict(use_pvs=False, aspiration_window=None, use_null_move=False, use_lmr=False,
+    use_quiescence_pruning=False),
+  "pvs": dict(use_pvs=True, aspiration_window=None, use_null_move=False, use_lmr=False, use_quiescence_pruning=False),
+  "pvs+aspiration": dict(use_pvs=True, aspiration_window=ASPIRATION_WINDOW, use_null_move=False, use_lmr=False,
+    use_quiescence_pruning=False),
+  "null-move": dict(use_pvs=True, aspiration_window=ASPIRATION_WINDOW, use_null_move=True, use_lmr=False,
+    use_quiescence_pruning=False),
+  "lmr": dict(use_pvs=True, aspiration_window=ASPIRATION_WINDOW, use_null_move=False, use_lmr=True,
+    use_quiescence_pruning=False),
+  "null-move+lmr": dict(use_pvs=True, aspiration_window=ASPIRATION_WINDOW, use_null_move=True, use_lmr=True,
+    use_quiescence_pruning=False),
+  "null-move+lmr+see": dict(use_pvs=True, aspiration_window=ASPIRATION_WINDOW, use_null_move=True, use_lmr=True,
+    use_quiescence_pruning=True),
+}
+
+
+def run_search(fen, depth, bonuses_file, options):
+  # fresh game state per run, so no run benefits from another's transposition table
+  game_state = GameState(PlayerType.ROBOT, PlayerType.ROBOT, depth, bonuses_file, fen)
+  for name, value in options.items():
+    setattr(game_state.ai, name, value)
+  game_state.ai.n_moves_searched = 0
+  game_state.ai.n_quiescence_moves = 0
+  start_time = time.time()
+  game_state.ai.iterative_deepening()
+  return game_state.ai.n_moves_searched, game_state.ai.n_quiescence_moves, time.time() - start_time, \
+    game_state.ai.move_ordering.first_move_cutoff_rate()
+
+
+def compare_search_modes(fens, depths, bonuses_file, modes):
+  results = []
+  for fen in fens:
+    for depth in depths:
+      for mode in modes:
+        n_moves_searched, n_quiescence_moves, seconds, cutoff_rate = run_search(fen, depth, bonuses_file,
+          SEARCH_MODES[mode])
+        results.append((fen, depth, mode, n_moves_searched, n_quiescence_moves, seconds, cutoff_rate))
+  return results
+
+
+def compare_thread_counts(fens, thread_counts, movetime, search_depth, bonuses_file):
+  results = []
+  for fen in fens:
+    for threads in thread_counts:
+      game_state = GameState(PlayerType.ROBOT, PlayerType.ROBOT, search_depth, bonuses_file, fen, threads=threads)
+      game_state.ai.n_moves_searched = 0
+      start_time = time.time()
+      game_state.ai.best_move(movetime=movetime)
+      seconds = time.time() - start_time
+      results.append((fen, threads, game_state.ai.completed_depth, game_state.ai.n_moves_searched, seconds))
+  print("\nRESULTS")
+  for fen, threads, depth, n_moves_searched, seconds in results:
+    print(f"\t{fen}\n\t\t{threads} threads: {n_moves_searched / seconds:.0f} moves/second, reached depth {depth}")
+  n_cores = os.cpu_count() or 1
+  if max(thread_counts) > n_cores:
+    # extra processes just take turns on the same cores, so lower moves/second there says nothing about scaling
+    print(f"\tonly {n_cores} cores available: runs with more threads than that share them and can't show scaling")
+
+
+def stepped_attacks(game_state, piece):
+  # attacked squares found the way they were before the per-square tables: step each offset and bounds check it
+  if piece.type is PieceType.PAWN:
+    offsets, slides = [(piece.player_color.pawn_direction, 1), (piece.player_color.pawn_direction, -1)], False
+  elif piece.type is PieceType.KNIGHT:
+    offsets, slides = KNIGHT_OFFSETS, False
+  elif piece.type is PieceType.BISHOP:
+    offsets, slides = BISHOP_DIRECTIONS, True
+  elif piece.type is PieceType.ROOK:
+    offsets, slides = ROOK_DIRECTIONS, True
+  elif piece.type is PieceType.QUEEN:
+    offsets, slides = KING_OFFSETS, True
+  else:  # piece.type is PieceType.KING:
+    offsets, slides = KING_OFFSETS, False
+  attacks = 0
+  for rank_direction, file_direction in offsets:
+    rank, file = piece.rank + rank_direction, piece.file + file_direction
+    while Board.in_bounds(rank, file):
+      attacks |= 1 << (rank * 8 + file)
+      if not slides or game_state.board[rank][file]:
+        break
+      rank += rank_direction
+      file += file_direction
+  return attacks
+
+
+class SteppedAttackBoard(AttackBoard):
+  def calculate_attacks(self, piece):
+    return stepped_attacks(self.game_state, piece)
+
+
+def stepped_pseudo_legal_moves(game_state, piece):
+  move_generator = game_state.move_generator
+  # pawn pushes and castling don't use the tables, so both paths share them
+  if piece.type is PieceType.PAWN:
+    return move_generator.generate_pawn_moves(piece)
+  moves = set()
+  for square in bit_squares(stepped_attacks(game_state, piece)):
+    move_generator.add_target_move(piece, *divmod(square, 8), moves, False)
+  if piece.type is PieceType.KING:
+    moves.update(move_generator.castling_moves(piece, False))
+  return moves
+
+
+def time_iterations(n_iterations, function):
+  start_time = time.time()
+  for _ in range(n_iterations):
+    function()
+  return n_iterations / (time.time() - start_time)
+
+
+def time_move_generation(fens, n_iterations):
+  # raw cost of the per-square attack and move loops, outside of any search, next to stepping offsets like before
+  print("\nRESULTS")
+  for fen in fens:
+    game_state = GameState(PlayerType.ROBOT, PlayerType.ROBOT, 1, None, fen)
+    player = game_state.active_player()
+    pieces = list(player.all_pieces())
+    move_generator = game_state.move_generator
+    stepped_refresh_rate = time_iterations(n_iterations, SteppedAttackBoard(player).refresh)
+    refresh_rate = time_iterations(n_iterations, player.refresh_attack_board)
+    stepped_generation_rate = time_iterations(n_iterations,
+      lambda: [stepped_pseudo_legal_moves(game_state, piece) for piece in pieces])
+    generation_rate = time_iterations(n_iterations,
+      lambda: [move_generator.generate_pseudo_legal_moves(piece, filter_castling_checks=False) for piece in pieces])
+    print(f"\t{fen}\n\t\tattack board refresh: {stepped_refresh_rate:.0f} -> {refresh_rate:.0f}/second, "
+      f"pseudo-legal move generation: {stepped_generation_rate:.0f} -> {generation_rate:.0f}/second")
+
+
+def time_nnue_evaluation(fens, nnue_file, n_plies, seed):
+  # evaluations per second along a random game, updating the accumulator per move versus rebuilding it per position
+  rng = random.Random(seed)
+  print("\nRESULTS")
+  for fen in fens:
+    game_state = GameState(PlayerType.ROBOT, PlayerType.ROBOT, 1, None, fen, nnue_file=nnue_file)
+    nnue = game_state.board.nnue
+    # play the game without the accumulator attached, so only the timed code below touches it
+    game_state.board.nnue = None
+    moves = []
+    for _ in range(n_plies):
+      legal_moves = game_state.generate_all_legal_moves(game_state.active_player_color)
+      if not legal_moves:
+        break
+      move = rng.choice(legal_moves)
+      move.make()
+      game_state.active_player_color = game_state.active_player_color.opponent
+      moves.append(move)
+    nnue.refresh(game_state)
+    incremental_seconds, full_seconds = 0, 0
+    for move in reversed(moves):
+      start_time = time.perf_counter()
+      nnue.update(move, unapply=True)
+      # the search takes the rook half of a castling move back separately, through Board.track
+      if move.castling_rook_move:
+        nnue.update(move.castling_rook_move, unapply=True)
+      incremental_score = nnue.evaluate()
+      incremental_seconds += time.perf_counter() - start_time
+      move.unmake()
+      game_state.active_player_color = game_state.active_player_color.opponent
+      start_time = time.perf_counter()
+      nnue.refresh(game_state)
+      full_score = nnue.evaluate()
+      full_seconds += time.perf_counter() - start_time
+      if abs(incremental_score - full_score) > 1:
+        print(f"\tincremental score {incremental_score} doesn't match {full_score} in {game_state.generate_fen()}")
+    print(f"\t{fen}\n\t\tincremental: {len(moves) / incremental_seconds:.0f} evals/sec, "
+      f"full recomputation: {len(moves) / full_seconds:.0f} evals/sec, over {len(moves)} plies")
+
+
+def print_results(results, baseline_mode):
+  baselines = dict(((fen, depth), (n_moves, n_quiescence_moves))
+    for fen, depth, mode, n_moves, n_quiescence_moves, _, _ in results if mode == baseline_mode)
+  print("\nRESULTS")
+  for fen, depth, mode, n_moves_searched, n_quiescence_moves, seconds, cutoff_rate in results:
+    baseline, quiescence_baseline = baselines.get((fen, depth), (None, None))
+    change = f"{100 * (n_moves_searched - baseline) / baseline:+.1f}%" if baseline else "n/a"
+    quiescence_change = f"{100 * (n_quiescence_moves - quiescence_baseline) / quiescence_baseline:+.1f}%" \
+      if quiescence_baseline else "n/a"
+    print(f"\t{fen}\n\t\tdepth {depth}, {mode}: {n_moves_searched} moves ({change} vs {baseline_mode}), "
+      f"{n_quiescence_moves} of them in quiescence ({quiescence_change}), in {seconds:.2f} seconds, "
+      f"{cutoff_rate:.1f}% first move cutoffs")
+
+
+if __name__ == "__main__":
+  parser = ArgumentParser()
+  parser.add_argument("--fen", action="append")
+  parser.add_argument("--depths", type=int, nargs="+", default=[4, 5, 6])
+  parser.add_argument("--modes", nargs="+", choices=SEARCH_MODES.keys(), default=list(SEARCH_MODES.keys()))
+  parser.add_argument("--baseline-mode", choices=SEARCH_MODES.keys(), default="alpha-beta")
+  parser.add_argument("--square-bonuses-file", default="resources/piece_square_bonuses.txt")
+  # compare parallel search throughput for these thread counts instead of comparing search modes
+  parser.add_argument("--threads", type=int, nargs="+")
+  parser.add_argument("--movetime", type=float, default=10)
+  parser.add_argument("--search-depth", type=int, default=20)
+  # time attack board and move generation loops instead of searching
+  parser.add_argument("--move-generation", type=int, metavar="N_ITERATIONS")
+  # time learned evaluation from this .npz weights file, incrementally and from scratch, instead of searching
+  parser.add_argument("--nnue-file")
+  parser.add_argument("--nnue-plies", type=int, default=200)
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+  if args.move_generation:
+    time_move_generation(args.fen or BENCHMARK_FENS, args.move_generation)
+  elif args.nnue_file:
+    time_nnue_evaluation(args.fen or BENCHMARK_FENS, args.nnue_file, args.nnue_plies, args.seed)
+  elif args.threads:
+    compare_thread_counts(args.fen or BENCHMARK_FENS, args.threads, args.movetime, args.search_depth,
+      args.square_bonuses_file)
+  else:
+    print_results(compare_search_modes(args.fen or BENCHMARK_FENS, args.depths, args.square_bonuses_file, args.modes),
+      args.baseline_mode)
@@ -0,0 +1,566 @@
+import os
+import random
+
+from core import index_to_san, san_to_index, CODE_PROMOTE_TYPES, CODE_PROMOTION, CODE_EN_PASSANT, CODE_CASTLING, \
+  ROOK_DIRECTIONS, BISHOP_DIRECTIONS, KING_OFFSETS, KNIGHT_OFFSETS
+from enums import PlayerColor, PieceType
+
+# squares are indexed rank * 8 + file, so a1 is 0 and h8 is 63, matching move codes
+# castling rights as a 4-bit mask, in "KQkq" order
+WHITE_KING_SIDE, WHITE_QUEEN_SIDE, BLACK_KING_SIDE, BLACK_QUEEN_SIDE = 1, 2, 4, 8
+FULL_BOARD = (1 << 64) - 1
+# rook and bishop magic numbers, searched for if missing, with attack tables built from them at import
+MAGICS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources", "slider_magics.txt")
+MAGICS_SEED = 2023
+CASTLING_FEN = [("K", WHITE_KING_SIDE), ("Q", WHITE_QUEEN_SIDE), ("k", BLACK_KING_SIDE), ("q", BLACK_QUEEN_SIDE)]
+# (king side, queen side) rights for each color
+CASTLING_RIGHTS = {PlayerColor.WHITE: (WHITE_KING_SIDE, WHITE_QUEEN_SIDE),
+  PlayerColor.BLACK: (BLACK_KING_SIDE, BLACK_QUEEN_SIDE)}
+
+
+def square_bit(rank, file):
+  return 1 << (rank * 8 + file)
+
+
+def lowest_square(bitboard):
+  return (bitboard & -bitboard).bit_length() - 1
+
+
+def bit_squares(bitboard):
+  while bitboard:
+    low_bit = bitboard & -bitboard
+    yield low_bit.bit_length() - 1
+    bitboard ^= low_bit
+
+
+def offset_targets(square, offsets):
+  rank, file = divmod(square, 8)
+  targets = 0
+  for rank_offset, file_offset in offsets:
+    if 0 <= rank + rank_offset < 8 and 0 <= file + file_offset < 8:
+      targets |= square_bit(rank + rank_offset, file + file_offset)
+  return targets
+
+
+def ray(square, rank_direction, file_direction):
+  rank, file = divmod(square, 8)
+  targets = 0
+  rank, file = rank + rank_direction, file + file_direction
+  while 0 <= rank < 8 and 0 <= file < 8:
+    targets |= square_bit(rank, file)
+    rank, file = rank + rank_direction, file + file_direction
+  return targets
+
+
+KNIGHT_ATTACKS = [offset_targets(square, KNIGHT_OFFSETS) for square in range(64)]
+KING_ATTACKS = [offset_targets(square, KING_OFFSETS) for square in range(64)]
+PAWN_ATTACKS = dict((color, [offset_targets(square, [(color.pawn_direction, 1), (color.pawn_direction, -1)])
+  for square in range(64)]) for color in PlayerColor)
+ROOK_RAYS = [[ray(square, *direction) for direction in ROOK_DIRECTIONS] for square in range(64)]
+BISHOP_RAYS = [[ray(square, *direction) for direction in BISHOP_DIRECTIONS] for square in range(64)]
+# for rays heading to higher squares the nearest blocker is the lowest bit, otherwise the highest
+ROOK_RAYS_INCREASING = [rank_direction * 8 + file_direction > 0 for rank_direction, file_direction in ROOK_DIRECTIONS]
+BISHOP_RAYS_INCREASING = [rank_direction * 8 + file_direction > 0
+  for rank_direction, file_direction in BISHOP_DIRECTIONS]
+ROOK_LINES = [ROOK_RAYS[square][0] | ROOK_RAYS[square][1] | ROOK_RAYS[square][2] | ROOK_RAYS[square][3]
+  for square in range(64)]
+BISHOP_LINES = [BISHOP_RAYS[square][0] | BISHOP_RAYS[square][1] | BISHOP_RAYS[square][2] | BISHOP_RAYS[square][3]
+  for square in range(64)]
+# squares strictly between two aligned squares, and the whole line through them (both empty if not aligned)
+BETWEEN = [[0] * 64 for _ in range(64)]
+LINE = [[0] * 64 for _ in range(64)]
+for from_square in range(64):
+  for rank_direction, file_direction in KING_OFFSETS:
+    full_line = (1 << from_square) | ray(from_square, rank_direction, file_direction) | \
+      ray(from_square, -rank_direction, -file_direction)
+    between = 0
+    rank, file = divmod(from_square, 8)
+    rank, file = rank + rank_direction, file + file_direction
+    while 0 <= rank < 8 and 0 <= file < 8:
+      BETWEEN[from_square][rank * 8 + file] = between
+      LINE[from_square][rank * 8 + file] = full_line
+      between |= square_bit(rank, file)
+      rank, file = rank + rank_direction, file + file_direction
+# rights lost when a piece moves from or to each square
+CASTLING_RIGHTS_LOST = [0] * 64
+for lost_square, lost_rights in [(0, WHITE_QUEEN_SIDE), (4, WHITE_KING_SIDE | WHITE_QUEEN_SIDE), (7, WHITE_KING_SIDE),
+    (56, BLACK_QUEEN_SIDE), (60, BLACK_KING_SIDE | BLACK_QUEEN_SIDE), (63, BLACK_KING_SIDE)]:
+  CASTLING_RIGHTS_LOST[lost_square] = lost_rights
+
+
+def slide_attacks(square, occupancy, rays, rays_increasing):
+  attacks = 0
+  square_rays = rays[square]
+  for direction_index, increasing in enumerate(rays_increasing):
+    ray_mask = square_rays[direction_index]
+    if blockers := ray_mask & occupancy:
+      blocker = lowest_square(blockers) if increasing else blockers.bit_length() - 1
+      # everything past the nearest blocker is hidden behind it
+      ray_mask ^= rays[blocker][direction_index]
+    attacks |= ray_mask
+  return attacks
+
+
+def relevant_occupancy_mask(square, rays):
+  # the last square of each ray doesn't change what the slider attacks, so it stays out of the magic index
+  mask = 0
+  for ray_mask in rays[square]:
+    if ray_mask:
+      furthest_square = max(bit_squares(ray_mask), key=lambda target: abs(target - square))
+      mask |= ray_mask ^ (1 << furthest_square)
+  return mask
+
+
+def occupancy_subsets(mask):
+  subset = 0
+  while True:
+    yield subset
+    subset = (subset - mask) & mask
+    if not subset:
+      return
+
+
+def magic_table(subsets, attacks, magic, shift):
+  # the attack table a multiplier hashes into, or None if two occupancies with different attacks collide
+  table = [0] * (1 << (64 - shift))
+  used = [False] * len(table)
+  for subset, subset_attacks in zip(subsets, attacks):
+    index = ((subset * magic) & FULL_BOARD) >> shift
+    if not used[index]:
+      used[index] = True
+      table[index] = subset_attacks
+    elif table[index] != subset_attacks:
+      return None
+  return table
+
+
+def find_magic(mask, subsets, attacks, shift, rng):
+  # search for a multiplier that hashes every relevant occupancy to its own slot, or to one with the same attacks
+  while True:
+    magic = rng.getrandbits(64) & rng.getrandbits(64) & rng.getrandbits(64)
+    if bin((mask * magic) & 0xff00000000000000).count("1") < 6:
+      continue
+    if (table := magic_table(subsets, attacks, magic, shift)) is not None:
+      return magic, table
+
+
+class SliderMagics:
+  # constant-time slider attacks: a table of attack sets per square, indexed by a perfect hash of the blockers
+  def __init__(self, rays, rays_increasing):
+    self.rays = rays
+    self.rays_increasing = rays_increasing
+    self.masks = [relevant_occupancy_mask(square, rays) for square in range(64)]
+    self.shifts = [64 - bin(mask).count("1") for mask in self.masks]
+    self.magics = [0] * 64
+    self.tables = [None] * 64
+
+  def build(self, magics, rng):
+    # builds each square's table from its known magic, and only searches again for squares whose magic is missing or
+    # doesn't hash cleanly. returns whether any magic had to be searched for
+    searched = False
+    for square in range(64):
+      mask, shift = self.masks[square], self.shifts[square]
+      subsets = list(occupancy_subsets(mask))
+      attacks = [slide_attacks(square, subset, self.rays, self.rays_increasing) for subset in subsets]
+      magic = magics[square] if square < len(magics) else None
+      table = magic_table(subsets, attacks, magic, shift) if magic else None
+      if table is None:
+        magic, table = find_magic(mask, subsets, attacks, shift, rng)
+        searched = True
+      self.magics[square], self.tables[square] = magic, table
+    return searched
+
+  def attacks(self, square, occupancy):
+    return self.tables[square][(((occupancy & self.masks[square]) * self.magics[square]) & FULL_BOARD) >>
+      self.shifts[square]]
+
+
+def read_magics(magics_file):
+  try:
+    with open(magics_file) as f:
+      magics = [int(line, 16) for line in f.read().split()]
+  except (OSError, ValueError):
+    return [], []
+  # 64 rook magics, then 64 bishop magics; anything else is treated as missing
+  if len(magics) != 128:
+    return [], []
+  return magics[:64], magics[64:]
+
+
+def write_magics(magics_file, magics):
+  # write next to the real file and swap it in, so a reader never sees half a file
+  temp_file = f"{magics_file}.tmp"
+  try:
+    with open(temp_file, "w") as f:
+      f.write("".join(f"{magic:016x}\n" for magic in magics))
+    os.replace(temp_file, magics_file)
+  except OSError as e:
+    print(f"couldn't save slider magics to {magics_file}, keeping them in memory: {e}")
+
+
+def load_slider_magics(magics_file=MAGICS_FILE):
+  # only the magic numbers are stored, since building the tables from them is quick, while searching for magics takes
+  # close to a minute in python
+  rook_magics = SliderMagics(ROOK_RAYS, ROOK_RAYS_INCREASING)
+  bishop_magics = SliderMagics(BISHOP_RAYS, BISHOP_RAYS_INCREASING)
+  known_rook_magics, known_bishop_magics = read_magics(magics_file)
+  rng = random.Random(MAGICS_SEED)
+  rook_searched = rook_magics.build(known_rook_magics, rng)
+  bishop_searched = bishop_magics.build(known_bishop_magics, rng)
+  if rook_searched or bishop_searched:
+    print(f"generated slider magics, saving them to {magics_file}")
+    write_magics(magics_file, rook_magics.magics + bishop_magics.magics)
+  return rook_magics, bishop_magics
+
+
+ROOK_MAGICS, BISHOP_MAGICS = load_slider_magics()
+
+
+def rook_attacks(square, occupancy):
+  return ROOK_MAGICS.attacks(square, occupancy)
+
+
+def bishop_attacks(square, occupancy):
+  return BISHOP_MAGICS.attacks(square, occupancy)
+
+
+def queen_attacks(square, occupancy):
+  return ROOK_MAGICS.attacks(square, occupancy) | BISHOP_MAGICS.attacks(square, occupancy)
+
+
+class Bitboards:
+  def __init__(self):
+    # one 64-bit int per piece type and color, plus an occupancy mask per color
+    self.pieces = dict((color, dict((piece_type, 0) for piece_type in PieceType)) for color in PlayerColor)
+    self.occupancy = dict((color, 0) for color in PlayerColor)
+
+  def load(self, board):
+    self.__init__()
+    for rank in range(8):
+      for file in range(8):
+        if piece := board[rank][file]:
+          self.toggle(piece.player_color, piece.type, rank * 8 + file)
+
+  def toggle(self, player_color, piece_type, square):
+    bit = 1 << square
+    self.pieces[player_color][piece_type] ^= bit
+    self.occupancy[player_color] ^= bit
+
+  def update(self, move):
+    # toggling is its own inverse, so the same update applies and unapplies a move
+    color = move.piece.player_color
+    self.toggle(color, PieceType.PAWN if move.promote_type else move.piece.type, move.old_rank * 8 + move.old_file)
+    self.toggle(color, move.promote_type or move.piece.type, move.rank * 8 + move.file)
+    if move.captured_piece:
+      self.toggle(move.captured_piece.player_color, move.captured_piece.type,
+        move.captured_piece.rank * 8 + move.captured_piece.file)
+
+  def all_occupancy(self):
+    return self.occupancy[PlayerColor.WHITE] | self.occupancy[PlayerColor.BLACK]
+
+  def attackers(self, square, by_color, occupancy=None):
+    if occupancy is None:
+      occupancy = self.all_occupancy()
+    pieces = self.pieces[by_color]
+    return (KNIGHT_ATTACKS[square] & pieces[PieceType.KNIGHT]) | \
+           (KING_ATTACKS[square] & pieces[PieceType.KING]) | \
+           (PAWN_ATTACKS[by_color.opponent][square] & pieces[PieceType.PAWN]) | \
+           (rook_attacks(square, occupancy) & (pieces[PieceType.ROOK] | pieces[PieceType.QUEEN])) | \
+           (bishop_attacks(square, occupancy) & (pieces[PieceType.BISHOP] | pieces[PieceType.QUEEN]))
+
+  def is_attacked(self, square, by_color):
+    return self.attackers(square, by_color) != 0
+
+  def static_exchange(self, from_square, to_square, captured_square=None):
+    # material the side moving from from_square ends up with if both sides keep recapturing on to_square with their
+    # least valuable piece, and either side may stop once recapturing stops paying
+    if captured_square is None:
+      captured_square = to_square
+    color, attacker_type = self.piece_at(from_square)
+    gains = [self.piece_at(captured_square)[1].score]
+    occupancy = self.all_occupancy() ^ (1 << from_square) ^ (1 << captured_square) | (1 << to_square)
+    side = color.opponent
+    while True:
+      # pieces already traded off stay in the piece boards, so mask them out, which also uncovers x-rays behind them
+      attackers = self.attackers(to_square, side, occupancy) & occupancy
+      if not attackers:
+        break
+      for piece_type in PieceType:
+        if side_attackers := attackers & self.pieces[side][piece_type]:
+          break
+      if piece_type is PieceType.KING and self.attackers(to_square, side.opponent, occupancy) & occupancy:
+        # the king can't recapture onto a defended square
+        break
+      gains.append(attacker_type.score - gains[-1])
+      occupancy ^= side_attackers & -side_attackers
+      attacker_type = piece_type
+      side = side.opponent
+    while len(gains) > 1:
+      last_gain = gains.pop()
+      gains[-1] = -max(-gains[-1], last_gain)
+    return gains[0]
+
+  def piece_at(self, square):
+    bit = 1 << square
+    for color in PlayerColor:
+      if self.occupancy[color] & bit:
+        for piece_type in PieceType:
+          if self.pieces[color][piece_type] & bit:
+            return color, piece_type
+    return None
+
+  def attacks(self, player_color):
+    occupancy = self.all_occupancy()
+    pieces = self.pieces[player_color]
+    attacks = 0
+    for square in bit_squares(pieces[PieceType.PAWN]):
+      attacks |= PAWN_ATTACKS[player_color][square]
+    for square in bit_squares(pieces[PieceType.KNIGHT]):
+      attacks |= KNIGHT_ATTACKS[square]
+    for square in bit_squares(pieces[PieceType.BISHOP] | pieces[PieceType.QUEEN]):
+      attacks |= bishop_attacks(square, occupancy)
+    for square in bit_squares(pieces[PieceType.ROOK] | pieces[PieceType.QUEEN]):
+      attacks |= rook_attacks(square, occupancy)
+    for square in bit_squares(pieces[PieceType.KING]):
+      attacks |= KING_ATTACKS[square]
+    return attacks
+
+  def in_check(self, player_color):
+    king = self.pieces[player_color][PieceType.KING]
+    return king != 0 and self.is_attacked(lowest_square(king), player_color.opponent)
+
+
+class CheckInfo:
+  # pins and checkers for the side to move, found once per position so each move's legality is a few mask tests
+  # instead of making the move and looking for attacks on the king
+  def __init__(self, bitboards, player_color):
+    self.bitboards = bitboards
+    self.opponent_color = player_color.opponent
+    self.occupancy = bitboards.all_occupancy()
+    self.king_square = lowest_square(bitboards.pieces[player_color][PieceType.KING])
+    # sliders keep attacking through the square the king steps away from
+    self.occupancy_without_king = self.occupancy ^ (1 << self.king_square)
+    self.checkers = bitboards.attackers(self.king_square, self.opponent_color, self.occupancy)
+    # squares a non-king move has to land on: anywhere, onto the checker or in its way, or nowhere in double check
+    if not self.checkers:
+      self.evasions = (1 << 64) - 1
+    elif self.checkers & (self.checkers - 1):
+      self.evasions = 0
+    else:
+      self.evasions = self.checkers | BETWEEN[self.king_square][lowest_square(self.checkers)]
+    # own pieces that are the only thing between the king and an opponent slider
+    self.pinned = 0
+    opponent_pieces = bitboards.pieces[self.opponent_color]
+    snipers = (ROOK_LINES[self.king_square] & (opponent_pieces[PieceType.ROOK] | opponent_pieces[PieceType.QUEEN])) | \
+              (BISHOP_LINES[self.king_square] & (opponent_pieces[PieceType.BISHOP] | opponent_pieces[PieceType.QUEEN]))
+    for sniper_square in bit_squares(snipers):
+      blockers = BETWEEN[self.king_square][sniper_square] & self.occupancy
+      if blockers and not blockers & (blockers - 1) and blockers & bitboards.occupancy[player_color]:
+        self.pinned |= blockers
+
+  def in_check(self):
+    return self.checkers != 0
+
+  def is_attacked(self, square):
+    return self.bitboards.attackers(square, self.opponent_color, self.occupancy) != 0
+
+  def is_legal(self, from_square, to_square, captured_square=None):
+    if from_square == self.king_square:
+      return not self.bitboards.attackers(to_square, self.opponent_color, self.occupancy_without_king)
+    if captured_square is not None and captured_square != to_square:
+      # en passant empties two squares on one rank, which can uncover a slider that neither pawn was pinned to
+      captured_bit = 1 << captured_square
+      occupancy = self.occupancy ^ (1 << from_square) ^ (1 << to_square) ^ captured_bit
+      return not self.bitboards.attackers(self.king_square, self.opponent_color, occupancy) & ~captured_bit
+    if not self.evasions & (1 << to_square):
+      return False
+    return not self.pinned & (1 << from_square) or LINE[self.king_square][from_square] & (1 << to_square) != 0
+
+
+class BitboardPosition(Bitboards):
+  # a standalone position that makes and unmakes move codes on bitboards alone, without Piece or Move objects
+  def __init__(self, fen):
+    super().__init__()
+    self.mailbox = [None] * 64
+    self.active_player_color = PlayerColor.WHITE
+    self.castling_rights = 0
+    self.en_passant_square = None
+    self.halfmove_clock = 0
+    self.fullmove_counter = 1
+    self.undo_stack = []
+    self.init_from_fen(fen)
+
+  def put(self, square, player_color, piece_type):
+    self.mailbox[square] = (player_color, piece_type)
+    self.toggle(player_color, piece_type, square)
+
+  def remove(self, square):
+    player_color, piece_type = self.mailbox[square]
+    self.mailbox[square] = None
+    self.toggle(player_color, piece_type, square)
+
+  def init_from_fen(self, fen):
+    piece_placement, side_to_move, castling_ability, en_passant_target_square, halfmove_clock, fullmove_counter = \
+      fen.split(" ")
+    for inverse_rank, rank_line in enumerate(piece_placement.split("/")):
+      rank = 7 - inverse_rank
+      file = 0
+      for piece_char in rank_line:
+        if piece_char.isdigit():
+          file += int(piece_char)
+        else:
+          self.put(rank * 8 + file, PlayerColor.WHITE if piece_char.isupper() else PlayerColor.BLACK,
+            PieceType(piece_char.lower()))
+          file += 1
+    self.active_player_color = PlayerColor.WHITE if side_to_move == "w" else PlayerColor.BLACK
+    for char, right in CASTLING_FEN:
+      if char in castling_ability:
+        self.castling_rights |= right
+    if en_passant_target_square != "-":
+      rank, file = san_to_index(en_passant_target_square[1], en_passant_target_square[0])
+      self.en_passant_square = rank * 8 + file
+    self.halfmove_clock = int(halfmove_clock) if halfmove_clock.isdigit() else 0
+    self.fullmove_counter = int(fullmove_counter) if fullmove_counter.isdigit() else 1
+
+  def generate_fen(self):
+    piece_placement_ranks = []
+    for rank in range(7, -1, -1):
+      n_empty_squares = 0
+      fen_line = []
+      for file in range(8):
+        if occupant := self.mailbox[rank * 8 + file]:
+          if n_empty_squares > 0:
+            fen_line.append(str(n_empty_squares))
+            n_empty_squares = 0
+          player_color, piece_type = occupant
+          fen_line.append(piece_type.value.upper() if player_color is PlayerColor.WHITE else piece_type.value)
+        else:
+          n_empty_squares += 1
+      if n_empty_squares > 0:
+        fen_line.append(str(n_empty_squares))
+      piece_placement_ranks.append("".join(fen_line))
+    castling_ability = "".join(char for char, right in CASTLING_FEN if self.castling_rights & right) or "-"
+    en_passant = index_to_san(*divmod(self.en_passant_square, 8)) if self.en_passant_square is not None else "-"
+    return f"{'/'.join(piece_placement_ranks)} {self.active_player_color.abbr} {castling_ability} {en_passant} " \
+           f"{self.halfmove_clock} {self.fullmove_counter}"
+
+  def add_pawn_moves(self, moves, from_square, to_square, promotion_rank):
+    if to_square // 8 == promotion_rank:
+      for promote_index in range(len(CODE_PROMOTE_TYPES)):
+        moves.append(from_square | (to_square << 6) | (promote_index << 12) | (CODE_PROMOTION << 14))
+    else:
+      moves.append(from_square | (to_square << 6))
+
+  def generate_pseudo_legal_moves(self):
+    color = self.active_player_color
+    pieces = self.pieces[color]
+    own = self.occupancy[color]
+    opponent = self.occupancy[color.opponent]
+    occupancy = own | opponent
+    moves = []
+    promotion_rank = color.opponent.back_rank
+    double_push_rank = color.back_rank + color.pawn_direction
+    push = 8 * color.pawn_direction
+    for square in bit_squares(pieces[PieceType.PAWN]):
+      for to_square in bit_squares(PAWN_ATTACKS[color][square] & opponent):
+        self.add_pawn_moves(moves, square, to_square, promotion_rank)
+      if self.en_passant_square is not None and PAWN_ATTACKS[color][square] & (1 << self.en_passant_square):
+        moves.append(square | (self.en_passant_square << 6) | (CODE_EN_PASSANT << 14))
+      to_square = square + push
+      if not occupancy & (1 << to_square):
+        self.add_pawn_moves(moves, square, to_square, promotion_rank)
+        if square // 8 == double_push_rank and not occupancy & (1 << (to_square + push)):
+          moves.append(square | ((to_square + push) << 6))
+    for square in bit_squares(pieces[PieceType.KNIGHT]):
+      for to_square in bit_squares(KNIGHT_ATTACKS[square] & ~own):
+        moves.append(square | (to_square << 6))
+    for square in bit_squares(pieces[PieceType.BISHOP] | pieces[PieceType.QUEEN]):
+      for to_square in bit_squares(bishop_attacks(square, occupancy) & ~own):
+        moves.append(square | (to_square << 6))
+    for square in bit_squares(pieces[PieceType.ROOK] | pieces[PieceType.QUEEN]):
+      for to_square in bit_squares(rook_attacks(square, occupancy) & ~own):
+        moves.append(square | (to_square << 6))
+    for square in bit_squares(pieces[PieceType.KING]):
+      for to_square in bit_squares(KING_ATTACKS[square] & ~own):
+        moves.append(square | (to_square << 6))
+      moves.extend(self.castling_moves(square, occupancy))
+    return moves
+
+  def castling_moves(self, king_square, occupancy):
+    color = self.active_player_color
+    king_side, queen_side = CASTLING_RIGHTS[color]
+    moves = []
+    if not self.castling_rights & (king_side | queen_side) or self.is_attacked(king_square, color.opponent):
+      return moves
+    # the king can't pass through an attacked square; the landing square is checked like any other move
+    if self.castling_rights & king_side and not occupancy & (0b11 << (king_square + 1)) and \
+        not self.is_attacked(king_square + 1, color.opponent):
+      moves.append(king_square | ((king_square + 2) << 6) | (CODE_CASTLING << 14))
+    if self.castling_rights & queen_side and not occupancy & (0b111 << (king_square - 3)) and \
+        not self.is_attacked(king_square - 1, color.opponent):
+      moves.append(king_square | ((king_square - 2) << 6) | (CODE_CASTLING << 14))
+    return moves
+
+  def make(self, move_code):
+    from_square, to_square, kind = move_code & 0x3f, (move_code >> 6) & 0x3f, move_code >> 14
+    player_color, piece_type = self.mailbox[from_square]
+    captured_square = to_square
+    if kind == CODE_EN_PASSANT:
+      captured_square = to_square - 8 * player_color.pawn_direction
+    captured = self.mailbox[captured_square]
+    self.undo_stack.append((move_code, piece_type, captured, captured_square, self.castling_rights,
+      self.en_passant_square, self.halfmove_clock))
+    if captured:
+      self.remove(captured_square)
+    self.remove(from_square)
+    self.put(to_square, player_color,
+      CODE_PROMOTE_TYPES[(move_code >> 12) & 0x3] if kind == CODE_PROMOTION else piece_type)
+    if kind == CODE_CASTLING:
+      rook_from, rook_to = (to_square + 1, to_square - 1) if to_square > from_square else (to_square - 2, to_square + 1)
+      self.remove(rook_from)
+      self.put(rook_to, player_color, PieceType.ROOK)
+    self.castling_rights &= ~(CASTLING_RIGHTS_LOST[from_square] | CASTLING_RIGHTS_LOST[to_square])
+    self.en_passant_square = (from_square + to_square) // 2 \
+      if piece_type is PieceType.PAWN and abs(to_square - from_square) == 16 else None
+    self.halfmove_clock = 0 if captured or piece_type is PieceType.PAWN else self.halfmove_clock + 1
+    if player_color is PlayerColor.BLACK:
+      self.fullmove_counter += 1
+    self.active_player_color = player_color.opponent
+
+  def unmake(self):
+    move_code, piece_type, captured, captured_square, self.castling_rights, self.en_passant_square, \
+      self.halfmove_clock = self.undo_stack.pop()
+    from_square, to_square, kind = move_code & 0x3f, (move_code >> 6) & 0x3f, move_code >> 14
+    player_color = self.active_player_color.opponent
+    self.active_player_color = player_color
+    if player_color is PlayerColor.BLACK:
+      self.fullmove_counter -= 1
+    if kind == CODE_CASTLING:
+      rook_from, rook_to = (to_square + 1, to_square - 1) if to_square > from_square else (to_square - 2, to_square + 1)
+      self.remove(rook_to)
+      self.put(rook_from, player_color, PieceType.ROOK)
+    self.remove(to_square)
+    self.put(from_square, player_color, piece_type)
+    if captured:
+      self.put(captured_square, *captured)
+
+  def generate_legal_moves(self):
+    player_color = self.active_player_color
+    legal_moves = []
+    for move_code in self.generate_pseudo_legal_moves():
+      self.make(move_code)
+      if not self.in_check(player_color):
+        legal_moves.append(move_code)
+      self.unmake()
+    return legal_moves
+
+  def perft(self, depth):
+    moves = self.generate_legal_moves()
+    if depth == 1:
+      return len(moves)
+    n_positions = 0
+    for move_code in moves:
+      self.make(move_code)
+      n_positions += self.perft(depth - 1)
+      self.unmake()
+    return n_positions
@@ -1,17 +1,35 @@
 import re
 
+from bitboards import Bitboards
 from core import empty_board_array
 from enums import PieceType, PlayerColor
 from zobrist import Zobrist
 
+# a piece's table applies to both phases unless the bonuses file gives it separate "midgame" and "endgame" tables
+MIDGAME, ENDGAME = 0, 1
+PHASES = {"midgame": MIDGAME, "endgame": ENDGAME}
+# game phase counts down from MAX_PHASE with all minor and major pieces on the board to 0 with none left
+PHASE_WEIGHTS = {PieceType.PAWN: 0, PieceType.KNIGHT: 1, PieceType.BISHOP: 1, PieceType.ROOK: 2, PieceType.QUEEN: 4,
+  PieceType.KING: 0}
+MAX_PHASE = 24
+
 
 class Board:
-  def __init__(self, bonuses_file, game_state):
+  def __init__(self, bonuses_file, game_state, nnue_file=None):
     self.bonuses = self.read_square_bonuses(bonuses_file) if bonuses_file else None
+    # learned evaluation, replacing material and square bonuses when a weights file is given
+    self.nnue = self.load_nnue(nnue_file) if nnue_file else None
     self.game_state = game_state
     self.squares = empty_board_array()
-    self.zobrist_key = Zobrist.init_key()
-    self.evaluation = None
+    # kept in sync with squares, for bitwise attack and check tests
+    self.bitboards = Bitboards()
+    # set once the position is loaded
+    self.zobrist_key = 0
+    self.pawn_key = 0
+    # running scores for white with midgame and endgame square bonuses, blended by phase on evaluation
+    self.midgame_score = 0
+    self.endgame_score = 0
+    self.phase = 0
 
   def __getitem__(self, item):
     return self.squares[item]
@@ -26,63 +44,99 @@ class Board:
     return flipped_board
 
   def read_square_bonuses(self, square_bonuses_file):
-    current_piece = None
-    piece_bonuses = dict()
+    current_table = None
+    piece_bonuses = dict((piece_type, [None, None]) for piece_type in PieceType)
     with open(square_bonuses_file, "r") as f:
       for line in f.readlines():
         text = line.strip()
         if not text:
           continue
-        if text.isalpha():
-          current_piece = PieceType(text)
-          piece_bonuses[current_piece] = []
+        if match := re.fullmatch(r"([a-z])(?:\s+(midgame|endgame))?", text):
+          current_piece = PieceType(match.group(1))
+          current_table = []
+          for phase in [PHASES[match.group(2)]] if match.group(2) else [MIDGAME, ENDGAME]:
+            piece_bonuses[current_piece][phase] = current_table
         else:
           rank = [int(v) for v in re.split(r",\s*", text)]
-          piece_bonuses[current_piece].append(rank)
+          current_table.append(rank)
     piece_bonuses_for_color = dict()
-    for piece, bonus_board in piece_bonuses.items():
-      piece_bonuses_for_color[piece] = dict()
-      piece_bonuses_for_color[piece][PlayerColor.BLACK] = piece_bonuses[piece]
-      piece_bonuses_for_color[piece][PlayerColor.WHITE] = self.flip_board(piece_bonuses[piece])
+    for piece, phase_boards in piece_bonuses.items():
+      piece_bonuses_for_color[piece] = []
+      for bonus_board in phase_boards:
+        bonus_board = bonus_board or [[0] * 8 for _ in range(8)]
+        piece_bonuses_for_color[piece].append({
+          PlayerColor.BLACK: bonus_board,
+          PlayerColor.WHITE: self.flip_board(bonus_board),
+        })
     return piece_bonuses_for_color
 
-  def lookup_bonus(self, piece_type, player_color, rank, file):
+  def load_nnue(self, nnue_file):
+    # imported here, so numpy is only needed for the learned evaluation
+    from nnue import NNUE
+    return NNUE.load(nnue_file)
+
+  def lookup_bonus(self, piece_type, player_color, rank, file, phase):
     if not self.bonuses:
       return 0
-    return self.bonuses[piece_type][player_color][rank][file]
+    return self.bonuses[piece_type][phase][player_color][rank][file]
 
-  def track(self, move, unapply=False):
-    self.zobrist_key = Zobrist.update_key(self.zobrist_key, move)
-    self.evaluation += (-1 if unapply else 1) * move.evaluation
-    # print(f"eval after {'un' if unapply else ''}applying move: {self.evaluation}\n\t{move}")
+  def track(self, move, unapply=False, pieces_only=False):
+    self.zobrist_key = Zobrist.update_key(self.zobrist_key, move, pieces_only)
+    self.pawn_key = Zobrist.update_pawn_key(self.pawn_key, move)
+    self.bitboards.update(move)
+    midgame_change, endgame_change, phase_change = move.evaluation
+    if unapply:
+      self.midgame_score -= midgame_change
+      self.endgame_score -= endgame_change
+      self.phase -= phase_change
+    else:
+      self.midgame_score += midgame_change
+      self.endgame_score += endgame_change
+      self.phase += phase_change
+    if self.nnue:
+      self.nnue.update(move, unapply)
 
   # evaluate board score for white (take negative for black)
+  @property
+  def evaluation(self):
+    # promotions can push the phase past its starting value
+    phase = min(self.phase, MAX_PHASE)
+    # truncate toward zero, so mirrored positions score the same for both sides
+    return int((self.midgame_score * phase + self.endgame_score * (MAX_PHASE - phase)) / MAX_PHASE)
+
   def full_evaluation(self):
-    score = 0
+    self.midgame_score, self.endgame_score, self.phase = 0, 0, 0
     for player in self.game_state.players.values():
-      for pieces in player.pieces.values():
-        for piece in pieces:
-          score += self.piece_evaluation(piece)
-    self.evaluation = score
+      for piece in player.all_pieces():
+        self.midgame_score += self.piece_evaluation(piece, MIDGAME)
+        self.endgame_score += self.piece_evaluation(piece, ENDGAME)
+        self.phase += PHASE_WEIGHTS[piece.type]
+    if self.nnue:
+      self.nnue.refresh(self.game_state)
 
-  def piecewise_evaluation(self, piece_type, player_color, rank, file):
+  def piecewise_evaluation(self, piece_type, player_color, rank, file, phase):
     score = 0
     perspective = 1 if player_color == PlayerColor.WHITE else -1
     score += perspective * piece_type.score
-    square_bonus = self.lookup_bonus(piece_type, player_color, rank, file)
+    square_bonus = self.lookup_bonus(piece_type, player_color, rank, file, phase)
     score += perspective * square_bonus
     return score
 
-  def piece_evaluation(self, piece):
+  def piece_evaluation(self, piece, phase):
     if not piece:
       return 0
-    return self.piecewise_evaluation(piece.type, piece.player_color, piece.rank, piece.file)
+    return self.piecewise_evaluation(piece.type, piece.player_color, piece.rank, piece.file, phase)
 
   def evaluate(self, move):
+    # changes to the midgame score, endgame score and phase, kept on the move so unapplying can reverse them
     old_type = PieceType.PAWN if move.promote_type else move.piece.type
-    return self.piece_evaluation(move.piece) - \
-           self.piecewise_evaluation(old_type, move.piece.player_color, move.old_rank, move.old_file) - \
-           self.piece_evaluation(move.captured_piece)
+    scores = [self.piece_evaluation(move.piece, phase) -
+              self.piecewise_evaluation(old_type, move.piece.player_color, move.old_rank, move.old_file, phase) -
+              self.piece_evaluation(move.captured_piece, phase) for phase in (MIDGAME, ENDGAME)]
+    phase_change = PHASE_WEIGHTS[move.piece.type] - PHASE_WEIGHTS[old_type]
+    if move.captured_piece:
+      phase_change -= PHASE_WEIGHTS[move.captured_piece.type]
+    return scores[0], scores[1], phase_change
 
   @classmethod
   def in_bounds(cls, rank, file):
@@ -1,4 +1,3 @@
-import copy
 import json
 import os
 import re
@@ -17,10 +16,10 @@ from chess_logger import Logging
 
 
 def find_legal_castles(king_side, game_state):
+  # the rook half of a castling move is only set up when it's made, so go by the king's destination
   king = game_state.active_player().find(PieceType.KING)
-  rook = game_state.active_player().find_castling_rook(king_side=king_side)
   for move in game_state.generate_legal_moves(king):
-    if move.castling_rook_move and move.castling_rook_move.piece == rook:
+    if abs(move.file - move.old_file) == 2 and move.file == (6 if king_side else 2):
       return move
   return None
 
@@ -84,7 +83,7 @@ def make_move(player_color, move_string, game_state, engine, openings, board_dis
       return False
   move = parse_move(move_string, game_state)
   Logging.debug(f"found {player_color} move for string {move_string}:\n\t{move}")
-  openings[game_state.board.zobrist_key].append((move_string, copy.deepcopy(move)))
+  openings[game_state.board.zobrist_key].append(move.encode())
   engine.make_move(move)
   # engine.print_stats()
   return True
@@ -137,13 +136,8 @@ def process_games(file, game, limit, pause_at_move, interactive):
 
 
 def to_json(openings):
-  result = defaultdict(list)
-  for key, moves in openings.items():
-    for move_string, move in moves:
-      json_move = move.to_json()
-      json_move["move_string"] = move_string
-      result[key].append(json_move)
-  return result
+  # book moves are stored as move codes, repeated once per game that played them
+  return dict((key, move_codes) for key, move_codes in openings.items())
 
 
 # todo: fix additional cases in Kasparov book
@@ -1,3 +1,30 @@
+from enums import PieceType
+
+# 16-bit move codes: from square (6 bits), to square (6 bits), promotion type (2 bits), kind of move (2 bits)
+# code 0 (a1 to a1) never happens, so it stands for "no move"
+CODE_PROMOTE_TYPES = [PieceType.KNIGHT, PieceType.BISHOP, PieceType.ROOK, PieceType.QUEEN]
+CODE_NORMAL = 0
+CODE_PROMOTION = 1
+CODE_EN_PASSANT = 2
+CODE_CASTLING = 3
+
+# (rank, file) steps for sliding directions and jumping pieces, shared by the bitboard tables and attack boards
+ROOK_DIRECTIONS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+BISHOP_DIRECTIONS = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+KING_OFFSETS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+KNIGHT_OFFSETS = [(2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2)]
+
+# checkmate scores are MATE_SCORE less the plies it takes to get mated, so a faster mate scores higher, and search
+# windows start just outside of them
+MATE_SCORE = 100000
+MATE_THRESHOLD = MATE_SCORE - 1000
+INFINITE_SCORE = MATE_SCORE + 1
+
+
+def is_mate_score(score):
+  return abs(score) >= MATE_THRESHOLD
+
+
 def empty_board_array(default_value=None):
   return [[default_value for _ in range(8)] for _ in range(8)]
 
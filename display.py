@@ -8,7 +8,6 @@ from pygame.rect import Rect
 
 from core import rank_to_san, file_to_san
 from enums import PieceType, PlayerColor
-from move import Move
 
 BACKGROUND_COLORS = [(235, 236, 208), (119, 149, 86)]
 SELECTED_SQUARE_COLOR = (252, 186, 3)
@@ -62,17 +61,17 @@ class BoardDisplay:
         if self.game_state.selected_piece:
           if (rank, file) == (self.game_state.selected_piece.piece.rank, self.game_state.selected_piece.piece.file):
             color = SELECTED_SQUARE_COLOR
-          elif Move(self.game_state.selected_piece.piece, rank, file, self.game_state) in self.game_state.selected_piece.legal_moves:
+          elif (rank, file) in self.game_state.selected_piece.legal_targets:
             color = LEGAL_MOVE_COLORS[square_type]
           else:
             color = BACKGROUND_COLORS[square_type]
         elif last_move and (rank, file) in [(last_move.old_rank, last_move.old_file), (last_move.rank, last_move.file)]:
           color = LAST_MOVE_COLORS[square_type]
         elif self.display_player_attacking and \
-            self.game_state.players[self.display_player_attacking].attack_board[rank][file]:
+            self.game_state.players[self.display_player_attacking].attack_board.attacks(rank, file):
           color = ATTACKING_COLORS[square_type]
         elif self.display_pawn_attacks and \
-            self.game_state.players[self.display_pawn_attacks].attack_board.pawn_board[rank][file]:
+            self.game_state.players[self.display_pawn_attacks].attack_board.pawn_attacks(rank, file):
           color = ATTACKING_COLORS[square_type]
         else:
           color = BACKGROUND_COLORS[square_type]
@@ -12,6 +12,7 @@ class SelectedPiece:
     self.piece = piece
     self.update_screen_pos(display_pos)
     self.legal_moves = game_state.move_generator.generate_legal_moves(piece)
+    self.legal_targets = set((move.rank, move.file) for move in self.legal_moves)
 
   def __str__(self):
     return f"Selected(piece={self.piece}, screen_pos={self.screen_pos}, legal_moves={self.legal_moves})"
@@ -54,6 +55,9 @@ class Engine:
     print(f"\tfen string: {self.game_state.generate_fen()}")
     print(f"\tboard eval: {self.game_state.board.evaluation}")
     print(f"\ttranspositions evaluated: {self.game_state.ai.transposition_table.n_transpositions_evaluated}")
+    print(f"\ttransposition table usage: {self.game_state.ai.transposition_table.usage()} permille")
+    print(f"\tevaluation cache hit rate: {self.game_state.ai.evaluator.eval_cache.hit_rate():.1%}")
+    print(f"\tpawn table hit rate: {self.game_state.ai.evaluator.pawn_table.hit_rate():.1%}")
     print(f"\tmove history: {self.format_move_history()}")
 
   def get_user_promote_type(self):
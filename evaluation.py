@@ -0,0 +1,102 @@
+from array import array
+
+from bitboards import bit_squares
+from enums import PlayerColor, PieceType
+
+# entries in the whole-position evaluation cache and in the pawn structure table (powers of 2)
+EVAL_CACHE_ENTRIES = 1 << 16
+PAWN_TABLE_ENTRIES = 1 << 14
+# pawn structure terms, in centipawns
+DOUBLED_PAWN_PENALTY = 12
+ISOLATED_PAWN_PENALTY = 15
+# by rank of a passed pawn, counted from its own side of the board
+PASSED_PAWN_BONUS = [0, 5, 10, 20, 35, 60, 100, 0]
+
+FILE_MASKS = [0x0101010101010101 << file for file in range(8)]
+ADJACENT_FILE_MASKS = [(FILE_MASKS[file - 1] if file > 0 else 0) | (FILE_MASKS[file + 1] if file < 7 else 0)
+  for file in range(8)]
+
+
+def ranks_ahead_mask(color, rank):
+  mask = 0
+  for ahead_rank in (range(rank + 1, 8) if color is PlayerColor.WHITE else range(rank)):
+    mask |= 0xff << (ahead_rank * 8)
+  return mask
+
+
+# squares an enemy pawn could stand on to stop a pawn, or capture it, on its way to promotion
+PASSED_PAWN_MASKS = dict((color, [ranks_ahead_mask(color, square // 8) &
+  (FILE_MASKS[square % 8] | ADJACENT_FILE_MASKS[square % 8]) for square in range(64)]) for color in PlayerColor)
+
+
+class ScoreCache:
+  # direct-mapped key -> score table, where a new score always replaces whatever shared its slot
+  def __init__(self, n_entries):
+    self.mask = n_entries - 1
+    self.keys = array('Q', bytes(8 * n_entries))
+    self.scores = array('q', bytes(8 * n_entries))
+    self.n_probes = 0
+    self.n_hits = 0
+
+  def probe(self, key):
+    self.n_probes += 1
+    index = key & self.mask
+    if self.keys[index] == key:
+      self.n_hits += 1
+      return self.scores[index]
+    return None
+
+  def store(self, key, score):
+    index = key & self.mask
+    self.keys[index] = key
+    self.scores[index] = score
+
+  def hit_rate(self):
+    return self.n_hits / self.n_probes if self.n_probes else 0
+
+
+class Evaluator:
+  # material and piece-square bonuses are kept up to date by Board.track, the rest is computed here and cached
+  def __init__(self, game_state):
+    self.game_state = game_state
+    self.eval_cache = ScoreCache(EVAL_CACHE_ENTRIES)
+    self.pawn_table = ScoreCache(PAWN_TABLE_ENTRIES)
+
+  # board score for white (take negative for black)
+  def evaluate(self):
+    board = self.game_state.board
+    score = self.eval_cache.probe(board.zobrist_key)
+    if score is None:
+      score = board.nnue.evaluate() if board.nnue else board.evaluation + self.pawn_structure()
+      self.eval_cache.store(board.zobrist_key, score)
+    return score
+
+  def pawn_structure(self):
+    board = self.game_state.board
+    score = self.pawn_table.probe(board.pawn_key)
+    if score is None:
+      pawns = board.bitboards.pieces
+      score = self.pawn_structure_score(pawns[PlayerColor.WHITE][PieceType.PAWN],
+        pawns[PlayerColor.BLACK][PieceType.PAWN])
+      self.pawn_table.store(board.pawn_key, score)
+    return score
+
+  @classmethod
+  def pawn_structure_score(cls, white_pawns, black_pawns):
+    return cls.pawn_structure_for_color(PlayerColor.WHITE, white_pawns, black_pawns) - \
+           cls.pawn_structure_for_color(PlayerColor.BLACK, black_pawns, white_pawns)
+
+  @classmethod
+  def pawn_structure_for_color(cls, color, pawns, opponent_pawns):
+    score = 0
+    for file in range(8):
+      n_pawns = bin(pawns & FILE_MASKS[file]).count("1")
+      if n_pawns > 1:
+        score -= DOUBLED_PAWN_PENALTY * (n_pawns - 1)
+      if n_pawns and not pawns & ADJACENT_FILE_MASKS[file]:
+        score -= ISOLATED_PAWN_PENALTY * n_pawns
+    for square in bit_squares(pawns):
+      if not opponent_pawns & PASSED_PAWN_MASKS[color][square]:
+        rank = square // 8
+        score += PASSED_PAWN_BONUS[rank if color is PlayerColor.WHITE else 7 - rank]
+    return score
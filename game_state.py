@@ -2,6 +2,7 @@ import json
 import re
 
 from ai import AI
+from bitboards import CASTLING_FEN
 from core import san_to_index, index_to_san
 from board import Board
 from piece import Piece
@@ -9,35 +10,49 @@ from enums import PlayerColor, PieceType
 from move import Move
 from move_generator import MoveGenerator
 from player_state import PlayerState
+from transpositions import DEFAULT_TABLE_MB
+from zobrist import Zobrist, EN_PASSANT_DISALLOWED_INDEX
 
 START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
 
 class GameState:
-  def __init__(self, white_player_type, black_player_type, search_depth=1, bonuses_file=None, fen=START_FEN, book_file=None):
+  def __init__(self, white_player_type, black_player_type, search_depth=1, bonuses_file=None, fen=START_FEN, book_file=None,
+      movetime=None, max_nodes=None, threads=1, hash_mb=DEFAULT_TABLE_MB, nnue_file=None, table_buffer=None):
     self.white_player_type = white_player_type
     self.black_player_type = black_player_type
     self.search_depth = search_depth
     self.bonuses_file = bonuses_file
     self.fen = fen
     self.book_file = book_file
+    self.movetime = movetime
+    self.max_nodes = max_nodes
+    self.threads = threads
+    self.hash_mb = hash_mb
+    self.nnue_file = nnue_file
     self.players = {
       PlayerColor.WHITE: PlayerState(PlayerColor.WHITE, white_player_type, self),
       PlayerColor.BLACK: PlayerState(PlayerColor.BLACK, black_player_type, self)
     }
-    self.board = Board(bonuses_file, self)
+    self.board = Board(bonuses_file, self, nnue_file)
     self.active_player_color = PlayerColor.WHITE
     self.selected_piece = None
+    # castling rights as a mask of the bitboards.CASTLING_FEN bits, and the en passant file for zobrist keys
+    self.castling_rights = 0
     self.en_passant_target_square = None
+    self.en_passant_file = EN_PASSANT_DISALLOWED_INDEX
+    # plies since the last capture or pawn move, and zobrist keys of the positions before each move made so far
+    self.halfmove_clock = 0
+    self.fullmove_counter = 1
+    self.key_history = []
     if not fen:
       fen = START_FEN
     self.init_from_fen(fen)
     self.opening_book = self.read_opening_book(book_file) if book_file else None
-    # todo: handle zobrist key for custom board state
     for player in self.players.values():
       player.refresh_attack_board()
     self.move_history = []
     self.move_generator = MoveGenerator(self)
-    self.ai = AI(search_depth, self)
+    self.ai = AI(search_depth, self, movetime, max_nodes, threads, hash_mb, table_buffer)
     self.active_player().refresh_legal_moves()
 
   def init_from_fen(self, fen):
@@ -52,37 +67,31 @@ class GameState:
         else:
           piece_type, piece_color = self.parse_piece_char(piece_char)
           piece = Piece(piece_color, piece_type, rank, file)
-          self.players[piece_color].pieces[piece_type].add(piece)
+          self.players[piece_color].pieces.add(piece)
           self.board[rank][file] = piece
           file += 1
     self.active_player_color = PlayerColor.WHITE if side_to_move == "w" else PlayerColor.BLACK
     self.init_castling_ability(castling_ability)
     self.init_en_passant_target_square(en_passant_target_square)
+    self.halfmove_clock = int(halfmove_clock) if halfmove_clock.isdigit() else 0
+    self.fullmove_counter = int(fullmove_counter) if fullmove_counter.isdigit() else 1
+    self.board.bitboards.load(self.board)
+    self.board.zobrist_key = Zobrist.key_for(self)
+    self.board.pawn_key = Zobrist.pawn_key_for(self)
     self.board.full_evaluation()
 
   def init_castling_ability(self, castling_ability):
-    # first assume that nobody can castle by setting the king and rook move counts to something nonzero
-    for color in PlayerColor:
-      for piece_type in [PieceType.KING, PieceType.ROOK]:
-        for piece in self.players[color].pieces[piece_type]:
-          piece.n_times_moved = 1
-    if castling_ability != "-":
-      for piece_char in castling_ability:
-        piece_type, piece_color = self.parse_piece_char(piece_char)
-        # king definitely hasn't moved
-        self.players[piece_color].find(PieceType.KING).n_times_moved = 0
-        # find and mark appropriate rook ("k"-side or "q"-side)
-        self.players[piece_color].find_castling_rook(king_side=piece_type is PieceType.KING).n_times_moved = 0
+    self.castling_rights = 0
+    for char, right in CASTLING_FEN:
+      if char in castling_ability:
+        self.castling_rights |= right
 
   def generate_castling_ability_fen(self):
-    castling_ability = ""
-    for color in PlayerColor:
-      if self.players[color].find(PieceType.KING).n_times_moved == 0:
-        for char, king_side in [("k", True), ("q", False)]:
-          rook = self.players[color].find_castling_rook(king_side)
-          if rook and rook.n_times_moved == 0:
-            castling_ability += char.upper() if color is PlayerColor.WHITE else char
-    return castling_ability or "-"
+    return "".join(char for char, right in CASTLING_FEN if self.castling_rights & right) or "-"
+
+  def set_en_passant_target_square(self, square):
+    self.en_passant_target_square = square
+    self.en_passant_file = square[1] if square else EN_PASSANT_DISALLOWED_INDEX
 
   def generate_en_passant_fen(self):
     return index_to_san(*self.en_passant_target_square) if self.en_passant_target_square else '-'
@@ -104,7 +113,20 @@ class GameState:
       if n_empty_squares > 0:
         fen_line.append(str(n_empty_squares))
       piece_placement_ranks.append("".join(fen_line))
-    return f"{'/'.join(piece_placement_ranks)} {self.active_player_color.abbr} {self.generate_castling_ability_fen()} {self.generate_en_passant_fen()} - -"
+    return f"{'/'.join(piece_placement_ranks)} {self.active_player_color.abbr} {self.generate_castling_ability_fen()} {self.generate_en_passant_fen()} {self.halfmove_clock} {self.fullmove_counter}"
+
+  def is_repetition(self):
+    # a position can only come back since the last irreversible move, and only with the same side to move, so check
+    # every other key back that far, starting four plies ago
+    key = self.board.zobrist_key
+    oldest_index = len(self.key_history) - min(self.halfmove_clock, len(self.key_history))
+    for index in range(len(self.key_history) - 4, oldest_index - 1, -2):
+      if self.key_history[index] == key:
+        return True
+    return False
+
+  def is_draw(self):
+    return self.halfmove_clock >= 100 or self.is_repetition()
 
   def parse_piece_char(self, piece_char):
     return PieceType(piece_char.lower()), PlayerColor.WHITE if piece_char.isupper() else PlayerColor.BLACK
@@ -114,7 +136,7 @@ class GameState:
     opening_book = dict()
     with open(book_file, "r") as f:
       for key_string, moves in json.load(f).items():
-        opening_book[int(key_string)] = [move_dict for move_dict in moves]
+        opening_book[int(key_string)] = [move for move in moves]
     return opening_book
 
   def active_player(self):
@@ -126,6 +148,9 @@ class GameState:
   def generate_all_legal_moves(self, active_player_color, filter_checks=True, captures_only=False):
     return self.move_generator.generate_and_mark_all_legal_moves(active_player_color, filter_checks, captures_only)
 
+  def generate_staged_moves(self, active_player_color):
+    return self.move_generator.generate_staged_moves(active_player_color)
+
   def best_move(self):
     return self.ai.best_move()
 
@@ -133,11 +158,11 @@ class GameState:
     moves = []
     if not self.opening_book:
       return moves
-    for opening_move_json in self.opening_book.get(self.board.zobrist_key, []):
-      moves.append(Move.from_json(opening_move_json, self))
+    for move_code in self.opening_book.get(self.board.zobrist_key, []):
+      moves.append(Move.decode(move_code, self))
     return moves
 
   def init_en_passant_target_square(self, square):
     if square != "-":
-      self.en_passant_target_square = san_to_index(square[0], square[1])
+      self.set_en_passant_target_square(san_to_index(square[1], square[0]))
 
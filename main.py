@@ -14,6 +14,10 @@ from game_state import GameState
 from chess_logger import Logging
 from flask import Flask
 from book_processor import parse_move
+from transpositions import DEFAULT_TABLE_MB
+from attack_board import AttackBoard
+from move_generator import MoveGenerator
+from move_ordering import MAX_PLY
 
 
 app = Flask(__name__)
@@ -74,14 +78,21 @@ def reset():
     game_state.search_depth,
     game_state.bonuses_file,
     game_state.fen,
-    game_state.book_file)
+    game_state.book_file,
+    game_state.movetime,
+    game_state.max_nodes,
+    game_state.threads,
+    game_state.hash_mb,
+    game_state.nnue_file)
   Globals.engine = Engine(Globals.game_state, Globals.board_display)
   Globals.engine.print_stats()
   return "reset board state"
 
 
-def main(search_depth, white_player_type, black_player_type, bonuses_file, fen, book_file):
-  Globals.game_state = GameState(white_player_type, black_player_type, search_depth, bonuses_file, fen, book_file)
+def main(search_depth, white_player_type, black_player_type, bonuses_file, fen, book_file, movetime, max_nodes, threads,
+    hash_mb, nnue_file):
+  Globals.game_state = GameState(white_player_type, black_player_type, search_depth, bonuses_file, fen, book_file,
+    movetime, max_nodes, threads, hash_mb, nnue_file)
   # Globals.board_display = BoardDisplay(Globals.game_state)
   Globals.engine = Engine(Globals.game_state, Globals.board_display)
   Globals.engine.print_stats()
@@ -110,19 +121,32 @@ def main(search_depth, white_player_type, black_player_type, bonuses_file, fen,
 
 if __name__ == "__main__":
   parser = ArgumentParser()
-  parser.add_argument("--search-depth", type=int, default=3)
+  # defaults to 3, or to as deep as the search can go when --movetime or --max-nodes should end it instead
+  parser.add_argument("--search-depth", type=int)
+  parser.add_argument("--movetime", type=float)
+  parser.add_argument("--max-nodes", type=int)
+  parser.add_argument("--threads", type=int, default=1)
+  parser.add_argument("--hash-mb", type=int, default=DEFAULT_TABLE_MB)
   parser.add_argument("--white-player", type=PlayerType, default=PlayerType.HUMAN)
   parser.add_argument("--black-player", type=PlayerType, default=PlayerType.ROBOT)
   parser.add_argument("--square-bonuses-file", default="resources/piece_square_bonuses.txt")
+  # evaluate with a learned network from this .npz weights file instead of the square bonuses
+  parser.add_argument("--nnue-file")
   parser.add_argument("--fen")
   parser.add_argument("--book-file")
   parser.add_argument("--profile", action="store_true")
   parser.add_argument("--verbose", action="store_true")
+  parser.add_argument("--verify-attack-boards", action="store_true")
+  parser.add_argument("--verify-legal-moves", action="store_true")
   args = parser.parse_args()
   Logging.verbose = args.verbose
+  AttackBoard.verify = args.verify_attack_boards
+  MoveGenerator.verify_legality = args.verify_legal_moves
   if args.profile:
     yappi.start()
-  main(args.search_depth, args.white_player, args.black_player, args.square_bonuses_file, args.fen, args.book_file)
+  search_depth = args.search_depth or (MAX_PLY if args.movetime or args.max_nodes else 3)
+  main(search_depth, args.white_player, args.black_player, args.square_bonuses_file, args.fen, args.book_file,
+    args.movetime, args.max_nodes, args.threads, args.hash_mb, args.nnue_file)
   if args.profile:
     yappi.get_func_stats().print_all(columns={
       0: ("name", 36),
@@ -2,8 +2,11 @@ from enum import Enum, auto
 from math import copysign
 
 from board import Board
-from core import index_to_san, file_to_san, rank_to_san
-from enums import PieceType
+from bitboards import CASTLING_RIGHTS_LOST, PAWN_ATTACKS
+from core import index_to_san, file_to_san, rank_to_san, CODE_PROMOTE_TYPES, CODE_PROMOTION, CODE_EN_PASSANT, \
+  CODE_CASTLING
+from enums import PieceType, PlayerColor
+from zobrist import Zobrist
 
 
 class MoveType(Enum):
@@ -18,6 +21,11 @@ class MoveType(Enum):
 
 
 class Move:
+  __slots__ = ["piece", "rank", "file", "game_state", "promote_type", "old_rank", "old_file", "castling_rook_move",
+    "move_type", "captured_piece", "cached_score_guess", "en_passant_target_square",
+    "previous_en_passant_target_square", "en_passant_file", "previous_en_passant_file", "castling_rights",
+    "previous_castling_rights", "previous_halfmove_clock", "evaluation", "san"]
+
   def __init__(self, piece, rank, file, game_state, promote_type=None, move_type=None, captured_piece=None,
         score_guess=None):
     self.piece = piece
@@ -30,17 +38,18 @@ class Move:
     self.castling_rook_move = None
     self.move_type = move_type or self.get_type()
     self.captured_piece = captured_piece
-    self.score_guess = score_guess
-    if self.move_type in MoveType.legal_types():
-      # we can find the captured piece and score guess if the move is legal
-      if not self.captured_piece:
-        self.captured_piece = game_state.board[rank][file]
-      if not self.score_guess:
-        self.score_guess = self.guess_score()
-    self.en_passant_target_square = self.compute_en_passant()
-    self.previous_en_passant_target_square = self.game_state.en_passant_target_square
-    self.original_castling_fen = self.game_state.generate_castling_ability_fen()
-    self.castling_fen_after_move = None
+    if not self.captured_piece and self.move_type is MoveType.CAPTURE:
+      self.captured_piece = game_state.board[rank][file]
+    # most candidates are never sorted or applied, so the ordering score and the state a move overwrites are only
+    # worked out once they're needed
+    self.cached_score_guess = score_guess
+    self.en_passant_target_square = None
+    self.previous_en_passant_target_square = None
+    self.en_passant_file = None
+    self.previous_en_passant_file = None
+    self.castling_rights = None
+    self.previous_castling_rights = None
+    self.previous_halfmove_clock = None
     self.evaluation = None
     self.san = None
 
@@ -56,7 +65,13 @@ class Move:
     return self.piece == other.piece and self.promote_type == other.promote_type and self.rank == other.rank and self.file == other.file
 
   def __hash__(self):
-    return hash(repr(self))
+    return self.encode()
+
+  @property
+  def score_guess(self):
+    if self.cached_score_guess is None:
+      self.cached_score_guess = self.guess_score()
+    return self.cached_score_guess
 
   def to_san(self, player):
     if self.piece.type is PieceType.PAWN:
@@ -82,18 +97,32 @@ class Move:
       'score_guess': self.score_guess
     }
 
+  def encode(self):
+    code = (self.old_rank * 8 + self.old_file) | ((self.rank * 8 + self.file) << 6)
+    if self.promote_type:
+      return code | (CODE_PROMOTE_TYPES.index(self.promote_type) << 12) | (CODE_PROMOTION << 14)
+    if self.captured_piece and self.captured_piece.rank != self.rank:
+      return code | (CODE_EN_PASSANT << 14)
+    if self.piece.type is PieceType.KING and abs(self.file - self.old_file) == 2:
+      return code | (CODE_CASTLING << 14)
+    return code
+
   @staticmethod
-  def from_json(json, game_state):
-    return Move(
-      game_state.board[json['old_rank']][json['old_file']],
-      json['rank'],
-      json['file'],
-      game_state,
-      json['promote_type'],
-      json['move_type'],
-      game_state.board[json['captured_piece']['rank']][json['captured_piece']['file']]
-          if json['captured_piece'] else None,
-      json['score_guess'])
+  def decode(code, game_state):
+    old_rank, old_file = divmod(code & 0x3f, 8)
+    rank, file = divmod((code >> 6) & 0x3f, 8)
+    piece = game_state.board[old_rank][old_file]
+    if not piece:
+      return None
+    kind = code >> 14
+    if kind == CODE_PROMOTION:
+      return Move(piece, rank, file, game_state, promote_type=CODE_PROMOTE_TYPES[(code >> 12) & 0x3])
+    if kind == CODE_EN_PASSANT:
+      # captured pawn sits beside the moving pawn, not on the target square
+      return Move(piece, rank, file, game_state, move_type=MoveType.CAPTURE,
+        captured_piece=game_state.board[old_rank][file])
+    # castling needs nothing extra, since applying a two-square king move brings the rook along
+    return Move(piece, rank, file, game_state)
 
   def get_type(self):
     if not Board.in_bounds(self.rank, self.file):
@@ -107,47 +136,90 @@ class Move:
       return MoveType.OPEN_SQUARE
 
   def apply(self):
-    player = self.game_state.players[self.piece.player_color]
+    # the full move for the game itself: make it, then keep the attack boards and move list the display needs
+    self.make()
+    self.update_attack_boards()
+    if not self.san:
+      self.san = self.to_san(self.game_state.players[self.piece.player_color])
+
+  def unapply(self):
+    self.unmake()
+    self.update_attack_boards()
+
+  def update_attack_boards(self):
+    for attack_player in self.game_state.players.values():
+      attack_player.update_attack_board(self)
+
+  def make(self, castling_rook=False):
+    # the search's fast path: only the board, piece lists, bitboards, key and evaluation change, and
+    # the state the move overwrites is kept on the move to undo it
+    self.previous_en_passant_target_square = self.game_state.en_passant_target_square
+    self.previous_en_passant_file = self.game_state.en_passant_file
+    self.previous_castling_rights = self.game_state.castling_rights
+    self.en_passant_target_square = self.compute_en_passant()
+    if not castling_rook:
+      self.record_clocks()
     if self.captured_piece:
-      self.game_state.players[self.captured_piece.player_color].pieces[self.captured_piece.type].remove(self.captured_piece)
+      self.game_state.players[self.captured_piece.player_color].pieces.remove(self.captured_piece)
       # do this explicitly to handle en passant captures (new piece doesn't cover captured square)
       self.game_state.board[self.captured_piece.rank][self.captured_piece.file] = None
     # track en passant possibility
-    self.game_state.en_passant_target_square = self.en_passant_target_square
+    self.game_state.set_en_passant_target_square(self.en_passant_target_square)
+    self.en_passant_file = self.game_state.en_passant_file
+    # moving from or onto a king or rook home square loses the rights that depend on it
+    self.game_state.castling_rights &= \
+      ~(CASTLING_RIGHTS_LOST[self.old_rank * 8 + self.old_file] | CASTLING_RIGHTS_LOST[self.rank * 8 + self.file])
     self.piece.rank = self.rank
     self.piece.file = self.file
     if self.promote_type:
-      self.piece.update_type(self.promote_type, self.game_state.players[self.piece.player_color].pieces)
+      self.game_state.players[self.piece.player_color].pieces.update_type(self.piece, self.promote_type)
     self.game_state.board[self.old_rank][self.old_file] = None
     self.game_state.board[self.rank][self.file] = self.piece
-    self.piece.n_times_moved += 1
     # handle castling special case
     file_diff = self.file - self.old_file
     if self.piece.type is PieceType.KING and abs(file_diff) == 2:
       is_king_side = file_diff == 2  # king moving two to the right
       self.castling_rook_move = Move(
-        player.find_castling_rook(king_side=is_king_side),
+        self.game_state.board[self.rank][7 if is_king_side else 0],
         self.piece.rank,
         self.piece.file - 1 if is_king_side else self.piece.file + 1,
-        self.game_state
+        self.game_state,
+        move_type=MoveType.OPEN_SQUARE
       )
-      self.castling_rook_move.apply()
-    self.castling_fen_after_move = self.game_state.generate_castling_ability_fen()
-    player.opponent().refresh_attack_board()
-    # todo: doing this for SAN in-check notation only, do we need it?
-    # player.refresh_attack_board()
+      # the king move updates the zobrist key for both pieces at once
+      self.castling_rook_move.make(castling_rook=True)
+    self.castling_rights = self.game_state.castling_rights
     self.evaluation = self.game_state.board.evaluate(self)
-    self.game_state.board.track(self)
-    if not self.san:
-      self.san = self.to_san(player)
+    self.game_state.board.track(self, pieces_only=castling_rook)
 
-  def unapply(self):
+  def record_clocks(self):
+    game_state = self.game_state
+    game_state.key_history.append(game_state.board.zobrist_key)
+    self.previous_halfmove_clock = game_state.halfmove_clock
+    if self.captured_piece or self.piece.type is PieceType.PAWN:
+      game_state.halfmove_clock = 0
+    else:
+      game_state.halfmove_clock += 1
+    if self.piece.player_color is PlayerColor.BLACK:
+      game_state.fullmove_counter += 1
+
+  def restore_clocks(self):
+    game_state = self.game_state
+    game_state.key_history.pop()
+    game_state.halfmove_clock = self.previous_halfmove_clock
+    if self.piece.player_color is PlayerColor.BLACK:
+      game_state.fullmove_counter -= 1
+
+  def unmake(self, castling_rook=False):
+    if not castling_rook:
+      self.restore_clocks()
     if self.castling_rook_move:
-      self.castling_rook_move.unapply()
+      self.castling_rook_move.unmake(castling_rook=True)
     if self.promote_type:
-      self.piece.update_type(PieceType.PAWN, self.game_state.players[self.piece.player_color].pieces)
-    # revert en passant possibility
-    self.game_state.en_passant_target_square = self.previous_en_passant_target_square
+      self.game_state.players[self.piece.player_color].pieces.update_type(self.piece, PieceType.PAWN)
+    # revert en passant possibility and castling rights
+    self.game_state.set_en_passant_target_square(self.previous_en_passant_target_square)
+    self.game_state.castling_rights = self.previous_castling_rights
     # return piece to starting square
     self.piece.rank = self.old_rank
     self.piece.file = self.old_file
@@ -155,24 +227,25 @@ class Move:
     self.game_state.board[self.old_rank][self.old_file] = self.piece
     # restore captured piece
     if self.captured_piece:
-      self.game_state.players[self.captured_piece.player_color].pieces[self.captured_piece.type].add(self.captured_piece)
+      self.game_state.players[self.captured_piece.player_color].pieces.add(self.captured_piece)
       # do this explicitly to handle en passant captures (new piece doesn't cover captured square)
       self.game_state.board[self.captured_piece.rank][self.captured_piece.file] = self.captured_piece
-    self.piece.n_times_moved -= 1
-    self.game_state.players[self.piece.player_color].opponent().refresh_attack_board()
     # apply same update to key to revert move
-    self.game_state.board.track(self, unapply=True)
+    self.game_state.board.track(self, unapply=True, pieces_only=castling_rook)
 
   def guess_score(self):
     score_guess = 0
     if entry := self.game_state.ai.transposition_table.from_key(self.game_state.board.zobrist_key):
-      if self == entry.move:
+      if entry.matches_move(self):
         score_guess += 10000
     if self.captured_piece:
-      score_guess = 10 * self.captured_piece.type.score - self.piece.type.score
+      score_guess += 10 * self.captured_piece.type.score - self.piece.type.score
     if self.promote_type:
       score_guess += self.promote_type.score
-    if self.game_state.players[self.piece.player_color.opponent].attack_board.pawn_board[self.rank][self.file]:
+    # quiet moves onto a square an enemy pawn attacks
+    enemy_pawns = self.game_state.board.bitboards.pieces[self.piece.player_color.opponent][PieceType.PAWN]
+    if not self.game_state.board[self.rank][self.file] and \
+        PAWN_ATTACKS[self.piece.player_color][self.rank * 8 + self.file] & enemy_pawns:
       score_guess -= self.piece.type.score
     return score_guess
 
@@ -207,3 +280,33 @@ class Move:
            from_san + \
            ('x' if self.captured_piece else '') + \
            index_to_san(self.rank, self.file)
+
+
+class NullMove:
+  def __init__(self, game_state):
+    self.game_state = game_state
+    self.previous_en_passant_target_square = game_state.en_passant_target_square
+    self.previous_en_passant_file = game_state.en_passant_file
+    self.previous_halfmove_clock = game_state.halfmove_clock
+
+  def __str__(self):
+    return "NullMove()"
+
+  def __repr__(self):
+    return str(self)
+
+  def make(self):
+    # no pieces move, so the evaluation is unchanged, and the clock restarts since going back to a position from
+    # before the null move isn't a real repetition
+    self.game_state.key_history.append(self.game_state.board.zobrist_key)
+    self.game_state.halfmove_clock = 0
+    self.game_state.set_en_passant_target_square(None)
+    self.game_state.board.zobrist_key = Zobrist.update_null_move_key(self.game_state.board.zobrist_key,
+      self.previous_en_passant_file)
+
+  def unmake(self):
+    self.game_state.key_history.pop()
+    self.game_state.halfmove_clock = self.previous_halfmove_clock
+    self.game_state.set_en_passant_target_square(self.previous_en_passant_target_square)
+    self.game_state.board.zobrist_key = Zobrist.update_null_move_key(self.game_state.board.zobrist_key,
+      self.previous_en_passant_file)
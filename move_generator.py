@@ -1,13 +1,15 @@
 from sortedcontainers import SortedList
 
+from bitboards import CheckInfo, CASTLING_RIGHTS, KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, bit_squares, \
+  rook_attacks, bishop_attacks, queen_attacks
 from enums import PieceType
 from move import Move, MoveType
 from chess_logger import Logging
 
-ROOK_DIRECTIONS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
-BISHOP_DIRECTIONS = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
-
 class MoveGenerator:
+  # when set, every legality check is repeated by making the move and looking for check
+  verify_legality = False
+
   def __init__(self, game_state):
     self.game_state = game_state
 
@@ -20,7 +22,8 @@ class MoveGenerator:
       # todo: generating all promotion pieces might cause performance issues
       # we need to support it for rare book games, but could handle in book_processor only
       for promote_type in [PieceType.QUEEN, PieceType.KNIGHT, PieceType.ROOK, PieceType.BISHOP]:
-        moves.add(Move(move.piece, move.rank, move.file, self.game_state, promote_type=promote_type))
+        moves.add(Move(move.piece, move.rank, move.file, self.game_state, promote_type=promote_type,
+          move_type=move.move_type, captured_piece=move.captured_piece))
     else:
       moves.add(move)
     return moves
@@ -29,17 +32,17 @@ class MoveGenerator:
     moves = set()
     pawn_direction = pawn.player_color.pawn_direction
     # capture moves
-    for rank_offset, file_offset in [(pawn_direction, 1), (pawn_direction, -1)]:
-      capture_move = Move(pawn, pawn.rank + rank_offset, pawn.file + file_offset, self.game_state)
-      if capture_move.move_type is MoveType.CAPTURE:
-        moves.update(self.include_promotion_moves(capture_move))
-      elif capture_move.move_type is MoveType.OPEN_SQUARE:
+    for capture_square in bit_squares(PAWN_ATTACKS[pawn.player_color][pawn.rank * 8 + pawn.file]):
+      capture_rank, capture_file = divmod(capture_square, 8)
+      if target := self.game_state.board[capture_rank][capture_file]:
+        if target.player_color is not pawn.player_color:
+          moves.update(self.include_promotion_moves(Move(pawn, capture_rank, capture_file, self.game_state,
+            move_type=MoveType.CAPTURE, captured_piece=target)))
+      else:
         # look for en passant
-        capture_rank = pawn.rank + rank_offset
-        capture_file = pawn.file + file_offset
         if (capture_rank, capture_file) == self.game_state.en_passant_target_square:
           moves.add(Move(pawn, capture_rank, capture_file, self.game_state,
-            move_type=MoveType.CAPTURE, captured_piece=self.game_state.board[pawn.rank][pawn.file + file_offset]))
+            move_type=MoveType.CAPTURE, captured_piece=self.game_state.board[pawn.rank][capture_file]))
     if captures_only:
       return moves
     # one-square standard move
@@ -50,126 +53,187 @@ class MoveGenerator:
       if not self.game_state.board[pawn.rank + (1 * pawn_direction)][pawn.file]:
         rank_candidates.append(pawn.rank + (2 * pawn_direction))
     for new_rank in rank_candidates:
-      capture_move = Move(pawn, new_rank, pawn.file, self.game_state)
-      if capture_move.move_type is MoveType.OPEN_SQUARE:
-        moves.update(self.include_promotion_moves(capture_move))
+      if not self.game_state.board[new_rank][pawn.file]:
+        moves.update(self.include_promotion_moves(Move(pawn, new_rank, pawn.file, self.game_state,
+          move_type=MoveType.OPEN_SQUARE)))
     return moves
 
-  def generate_slide_moves(self, piece, directions, captures_only=False):
+  def generate_slide_moves(self, piece, slider_attacks, captures_only=False):
+    # one magic lookup gives every reachable square
+    targets = slider_attacks(piece.rank * 8 + piece.file, self.game_state.board.bitboards.all_occupancy())
+    return self.generate_target_moves(piece, targets, captures_only)
+
+  def generate_target_moves(self, piece, targets, captures_only):
+    # only real moves get a Move object
+    bitboards = self.game_state.board.bitboards
+    targets &= bitboards.occupancy[piece.player_color.opponent] if captures_only else \
+      ~bitboards.occupancy[piece.player_color]
     moves = set()
-    for rank_direction, file_direction in directions:
-      collision = False
-      distance = 1
-      while not collision:
-        move = Move(piece, distance * rank_direction + piece.rank, distance * file_direction + piece.file, self.game_state)
-        if move.move_type in (MoveType.SELF_OCCUPIED, MoveType.OUT_OF_BOUNDS):
-          collision = True
-        else:
-          self.add_move_if_valid(move, moves, captures_only)
-          if move.move_type is MoveType.CAPTURE:
-            collision = True
-        distance += 1
+    for square in bit_squares(targets):
+      self.add_target_move(piece, *divmod(square, 8), moves, captures_only)
     return moves
 
-  def add_move_if_valid(self, move, moves, captures_only):
-    if move.move_type is MoveType.CAPTURE:
-      moves.add(move)
-    elif not captures_only and move.move_type is MoveType.OPEN_SQUARE:
-      moves.add(move)
+  def add_target_move(self, piece, rank, file, moves, captures_only):
+    # look at the target square before building a Move, so blocked squares cost nothing
+    if target := self.game_state.board[rank][file]:
+      if target.player_color is not piece.player_color:
+        moves.add(Move(piece, rank, file, self.game_state, move_type=MoveType.CAPTURE, captured_piece=target))
+    elif not captures_only:
+      moves.add(Move(piece, rank, file, self.game_state, move_type=MoveType.OPEN_SQUARE))
 
   def generate_knight_moves(self, piece, captures_only=False):
-    moves = set()
-    for far_rank in [True, False]:
-      for rank_direction in [1, -1]:
-        for file_direction in [1, -1]:
-          move = Move(
-            piece,
-            (2 if far_rank else 1) * rank_direction + piece.rank,
-            (1 if far_rank else 2) * file_direction + piece.file,
-            self.game_state)
-          self.add_move_if_valid(move, moves, captures_only)
-    return moves
+    return self.generate_target_moves(piece, KNIGHT_ATTACKS[piece.rank * 8 + piece.file], captures_only)
+
+  def check_info(self, player_color):
+    return CheckInfo(self.game_state.board.bitboards, player_color)
 
-  def castling_moves(self, king, filter_checks):
+  def castling_moves(self, king, filter_checks, check_info=None):
     Logging.debug("finding legal castle moves")
     moves = set()
-    if king.n_times_moved == 0:
-      player = self.game_state.players[king.player_color]
-      for rook in player.pieces[PieceType.ROOK]:
-        if rook.n_times_moved == 0:
-          can_castle = True
-          new_file = king.file + 2 if rook.file - king.file > 0 else king.file - 2
-          small_file, big_file = sorted([king.file, rook.file])
-          move = Move(king, king.rank, new_file, self.game_state)
-          for file_between in range(small_file + 1, big_file):
-            if self.game_state.board[king.rank][file_between]:
-              Logging.debug(f"piece between king and rook, castle move invalid:\n\t{move}")
+    for right, rook_file in zip(CASTLING_RIGHTS[king.player_color], [7, 0]):
+      rook = self.game_state.board[king.rank][rook_file]
+      if self.game_state.castling_rights & right and rook and rook.type is PieceType.ROOK:
+        can_castle = True
+        new_file = king.file + 2 if rook.file - king.file > 0 else king.file - 2
+        small_file, big_file = sorted([king.file, rook.file])
+        move = Move(king, king.rank, new_file, self.game_state, move_type=MoveType.OPEN_SQUARE)
+        for file_between in range(small_file + 1, big_file):
+          if self.game_state.board[king.rank][file_between]:
+            Logging.debug(f"piece between king and rook, castle move invalid:\n\t{move}")
+            can_castle = False
+            break
+        if can_castle:
+          if filter_checks:
+            check_info = check_info or self.check_info(king.player_color)
+            if check_info.in_check():
+              Logging.debug(f"player currently in check, castle move invalid:\n\t{move}")
+              can_castle = False
+            elif check_info.is_attacked(king.rank * 8 + (king.file + 1 if rook.file > king.file else king.file - 1)):
+              # player would be castling through check
+              Logging.debug(f"middle square in check, castle move invalid:\n\t{move}")
               can_castle = False
-              break
           if can_castle:
-            if filter_checks:
-              if player.in_check():
-                Logging.debug(f"player currently in check, castle move invalid:\n\t{move}")
-                can_castle = False
-              else:
-                # make a fake king move to the space between
-                fake_move = Move(
-                  king,
-                  king.rank,
-                  king.file + 1 if rook.file - king.file > 0 else king.file - 1,
-                  self.game_state)
-                fake_move.apply()
-                if player.in_check():
-                  # player would be castling through check
-                  Logging.debug(f"middle square in check, castle move invalid:\n\t{move}")
-                  can_castle = False
-                fake_move.unapply()
-            if can_castle:
-              moves.add(move)
+            moves.add(move)
     return moves
 
-  def generate_king_moves(self, king, filter_checks=True, captures_only=False):
-    moves = set()
-    for rank_direction, file_direction in ROOK_DIRECTIONS + BISHOP_DIRECTIONS:
-      move = Move(king, rank_direction + king.rank, file_direction + king.file, self.game_state)
-      self.add_move_if_valid(move, moves, captures_only)
-    moves.update(self.castling_moves(king, filter_checks))
+  def generate_king_moves(self, king, filter_checks=True, captures_only=False, check_info=None):
+    moves = self.generate_target_moves(king, KING_ATTACKS[king.rank * 8 + king.file], captures_only)
+    if not captures_only:
+      moves.update(self.castling_moves(king, filter_checks, check_info))
     return moves
 
-  def generate_legal_moves(self, piece, filter_checks=True, captures_only=False):
+  def generate_pseudo_legal_moves(self, piece, captures_only=False, filter_castling_checks=True, check_info=None):
     if piece.type is PieceType.PAWN:
       moves = self.generate_pawn_moves(piece, captures_only)
     elif piece.type is PieceType.KNIGHT:
       moves = self.generate_knight_moves(piece, captures_only)
     elif piece.type is PieceType.BISHOP:
-      moves = self.generate_slide_moves(piece, BISHOP_DIRECTIONS, captures_only)
+      moves = self.generate_slide_moves(piece, bishop_attacks, captures_only)
     elif piece.type is PieceType.ROOK:
-      moves = self.generate_slide_moves(piece, ROOK_DIRECTIONS, captures_only)
+      moves = self.generate_slide_moves(piece, rook_attacks, captures_only)
     elif piece.type is PieceType.QUEEN:
-      moves = self.generate_slide_moves(piece, ROOK_DIRECTIONS + BISHOP_DIRECTIONS, captures_only)
+      moves = self.generate_slide_moves(piece, queen_attacks, captures_only)
     else:  # piece.type is PieceType.KING:
-      moves = self.generate_king_moves(piece, filter_checks, captures_only)
+      moves = self.generate_king_moves(piece, filter_castling_checks, captures_only, check_info)
+    return moves
+
+  def is_legal(self, move, check_info=None):
+    check_info = check_info or self.check_info(move.piece.player_color)
+    legal = check_info.is_legal(move.old_rank * 8 + move.old_file, move.rank * 8 + move.file,
+      move.captured_piece.rank * 8 + move.captured_piece.file if move.captured_piece else None)
+    if MoveGenerator.verify_legality:
+      assert legal == self.is_legal_after_move(move), \
+        f"pin/check legality of {move} doesn't match making it in {self.game_state.generate_fen()}"
+    return legal
+
+  def is_legal_after_move(self, move):
+    player = self.game_state.players[move.piece.player_color]
+    move.make()
+    legal = not player.in_check()
+    if not legal:
+      Logging.debug(f"{move} not legal, puts {player.player_color} in check!")
+    move.unmake()
+    return legal
+
+  def generate_legal_moves(self, piece, filter_checks=True, captures_only=False, check_info=None):
+    if filter_checks:
+      check_info = check_info or self.check_info(piece.player_color)
+    moves = self.generate_pseudo_legal_moves(piece, captures_only, filter_checks, check_info)
     if filter_checks:
-      player = self.game_state.players[piece.player_color]
-      legal_moves = []
-      for move in moves:
-        move.apply()
-        if filter_checks and player.in_check():
-          Logging.debug(f"{move} not legal, puts {player.player_color} in check!")
-        else:
-          legal_moves.append(move)
-        move.unapply()
-      return legal_moves
+      return [move for move in moves if self.is_legal(move, check_info)]
     else:
       return moves
 
   def generate_and_mark_all_legal_moves(self, active_player_color, filter_checks=True, captures_only=False):
     player = self.game_state.players[active_player_color]
-    # keep move list in sorted order by score guess
+    move_ordering = self.game_state.ai.move_ordering
+    # keep move list in sorted order by score guess, plus killer/counter-move/history bonuses for quiet moves
     all_legal_moves = SortedList(key=lambda t: t[0])
-    for pieces in player.pieces.values():
-      for piece in pieces:
-        for move in self.generate_legal_moves(piece, filter_checks, captures_only):
-          all_legal_moves.add((move.score_guess, move))
+    check_info = self.check_info(active_player_color) if filter_checks else None
+    for piece in player.all_pieces():
+      for move in self.generate_legal_moves(piece, filter_checks, captures_only, check_info):
+        all_legal_moves.add((move.score_guess + move_ordering.bonus(move), move))
     # return high scores first
     return [move for score_guess, move in reversed(all_legal_moves)]
+
+  def validate_move_code(self, move_code, active_player_color, check_info=None):
+    # a stored move code may come from another position that shares this square, so regenerate the piece's moves
+    old_rank, old_file = divmod(move_code & 0x3f, 8)
+    piece = self.game_state.board[old_rank][old_file]
+    if not piece or piece.player_color is not active_player_color:
+      return None
+    check_info = check_info or self.check_info(active_player_color)
+    for move in self.generate_pseudo_legal_moves(piece, check_info=check_info):
+      if move.encode() == move_code:
+        return move if self.is_legal(move, check_info) else None
+    return None
+
+  def static_exchange(self, move):
+    return self.game_state.board.bitboards.static_exchange(move.old_rank * 8 + move.old_file,
+      move.rank * 8 + move.file, move.captured_piece.rank * 8 + move.captured_piece.file)
+
+  def is_bad_capture(self, move):
+    # loses material once the opponent's recaptures are played out
+    return move.captured_piece.type.score < move.piece.type.score and self.static_exchange(move) < 0
+
+  def generate_staged_moves(self, active_player_color):
+    # yields moves best-first, only generating and checking the legality of each stage once the search reaches it,
+    # so a cutoff on an early move skips the rest of the work
+    player = self.game_state.players[active_player_color]
+    move_ordering = self.game_state.ai.move_ordering
+    yielded_codes = set()
+    check_info = self.check_info(active_player_color)
+    # stage 1: best move from the transposition table
+    if entry := self.game_state.ai.transposition_table.from_key(self.game_state.board.zobrist_key):
+      if entry.move_code and (move := self.validate_move_code(entry.move_code, active_player_color, check_info)):
+        yielded_codes.add(entry.move_code)
+        yield move
+    # stage 2: captures that don't lose material, by MVV-LVA
+    captures = [move for piece in player.all_pieces() for move in self.generate_pseudo_legal_moves(piece, True)
+      if move.captured_piece and move.encode() not in yielded_codes]
+    captures.sort(key=lambda move: move.score_guess, reverse=True)
+    bad_captures = []
+    for move in captures:
+      if self.is_bad_capture(move):
+        bad_captures.append(move)
+      elif self.is_legal(move, check_info):
+        yield move
+    # stage 3: killer moves
+    for killer_code in move_ordering.killer_codes():
+      if killer_code not in yielded_codes and \
+          (move := self.validate_move_code(killer_code, active_player_color, check_info)):
+        if not move.captured_piece:
+          yielded_codes.add(killer_code)
+          yield move
+    # stage 4: quiet moves, by counter-move and history bonuses
+    quiets = [move for piece in player.all_pieces()
+      for move in self.generate_pseudo_legal_moves(piece, check_info=check_info)
+      if not move.captured_piece and move.encode() not in yielded_codes]
+    quiets.sort(key=lambda move: move.score_guess + move_ordering.bonus(move), reverse=True)
+    for move in quiets:
+      if self.is_legal(move, check_info):
+        yield move
+    # stage 5: captures that look like they lose material
+    for move in bad_captures:
+      if self.is_legal(move, check_info):
+        yield move
@@ -0,0 +1,111 @@
+from enums import PlayerColor
+
+MAX_PLY = 64
+# ordering bonuses for quiet moves, which sit between most captures (MVV-LVA) and the rest of the quiet moves
+KILLER_BONUSES = [500, 450]
+COUNTER_MOVE_BONUS = 400
+HISTORY_BONUS = 300
+# history scores are halved once any one reaches this, so recent cutoffs outweigh old ones
+HISTORY_MAX = 1 << 14
+
+
+def square_index(rank, file):
+  return rank * 8 + file
+
+
+def is_quiet(move):
+  return not move.captured_piece and not move.promote_type
+
+
+class MoveOrdering:
+  def __init__(self, game_state):
+    self.game_state = game_state
+    # moves currently applied by the search, so we know the ply and the move we're replying to
+    self.search_stack = []
+    self.killers = [[None] * len(KILLER_BONUSES) for _ in range(MAX_PLY)]
+    # butterfly history, indexed by [color][from square][to square]
+    self.history = dict((color, [[0] * 64 for _ in range(64)]) for color in PlayerColor)
+    # quiet move that refuted the opponent's last move, indexed by [opponent color][from square][to square]
+    self.counter_moves = dict((color, [[None] * 64 for _ in range(64)]) for color in PlayerColor)
+    self.n_beta_cutoffs = 0
+    self.n_first_move_cutoffs = 0
+
+  def new_search(self):
+    self.search_stack = []
+    self.killers = [[None] * len(KILLER_BONUSES) for _ in range(MAX_PLY)]
+    self.n_beta_cutoffs = 0
+    self.n_first_move_cutoffs = 0
+    self.age_history()
+
+  def age_history(self):
+    for color_history in self.history.values():
+      for from_history in color_history:
+        for to_square in range(64):
+          from_history[to_square] //= 2
+
+  def push(self, move):
+    self.search_stack.append(move)
+
+  def pop(self):
+    self.search_stack.pop()
+
+  def ply(self):
+    return len(self.search_stack)
+
+  def previous_move(self):
+    if self.search_stack:
+      return self.search_stack[-1]
+    return self.game_state.move_history[-1] if self.game_state.move_history else None
+
+  def killer_codes(self):
+    ply = self.ply()
+    if ply >= MAX_PLY:
+      return []
+    return [killer for killer in self.killers[ply] if killer]
+
+  def counter_move(self):
+    previous_move = self.previous_move()
+    if not previous_move:
+      return None
+    return self.counter_moves[previous_move.piece.player_color][
+      square_index(previous_move.old_rank, previous_move.old_file)][square_index(previous_move.rank, previous_move.file)]
+
+  def bonus(self, move):
+    if not is_quiet(move):
+      return 0
+    move_code = move.encode()
+    ply = self.ply()
+    if ply < MAX_PLY:
+      for killer, killer_bonus in zip(self.killers[ply], KILLER_BONUSES):
+        if move_code == killer:
+          return killer_bonus
+    if move_code == self.counter_move():
+      return COUNTER_MOVE_BONUS
+    history = self.history[move.piece.player_color][square_index(move.old_rank, move.old_file)][
+      square_index(move.rank, move.file)]
+    return HISTORY_BONUS * history // HISTORY_MAX
+
+  def record_cutoff(self, move, depth, move_index):
+    self.n_beta_cutoffs += 1
+    if move_index == 0:
+      self.n_first_move_cutoffs += 1
+    if not is_quiet(move):
+      return
+    move_code = move.encode()
+    ply = self.ply()
+    if ply < MAX_PLY and self.killers[ply][0] != move_code:
+      # shift older killers down, keeping the newest in the first slot
+      self.killers[ply] = [move_code] + self.killers[ply][:-1]
+    color_history = self.history[move.piece.player_color]
+    from_square = square_index(move.old_rank, move.old_file)
+    to_square = square_index(move.rank, move.file)
+    color_history[from_square][to_square] += depth * depth
+    if color_history[from_square][to_square] >= HISTORY_MAX:
+      self.age_history()
+    if previous_move := self.previous_move():
+      self.counter_moves[previous_move.piece.player_color][
+        square_index(previous_move.old_rank, previous_move.old_file)][
+        square_index(previous_move.rank, previous_move.file)] = move_code
+
+  def first_move_cutoff_rate(self):
+    return 100 * self.n_first_move_cutoffs / self.n_beta_cutoffs if self.n_beta_cutoffs else 0
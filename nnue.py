@@ -0,0 +1,58 @@
+import numpy as np
+
+from enums import PlayerColor, PieceType
+
+# one input feature per (color, piece type, square)
+PIECE_TYPE_INDEX = dict((piece_type, index) for index, piece_type in enumerate(PieceType))
+N_FEATURES = len(PlayerColor) * len(PieceType) * 64
+# first layer outputs are clipped to [0, ACTIVATION_CLIP] before the output layer
+ACTIVATION_CLIP = 1.0
+
+
+def feature_index(player_color, piece_type, rank, file):
+  color_index = 0 if player_color is PlayerColor.WHITE else 1
+  return (color_index * len(PieceType) + PIECE_TYPE_INDEX[piece_type]) * 64 + rank * 8 + file
+
+
+class NNUE:
+  # a two layer network over piece-square features, scoring in centipawns for white. the first layer's output (the
+  # accumulator) only changes by a few weight rows per move, so moves add and subtract those rows instead of
+  # recomputing it
+  def __init__(self, feature_weights, feature_bias, output_weights, output_bias):
+    if feature_weights.shape[0] != N_FEATURES:
+      raise Exception(f"expected {N_FEATURES} feature weight rows, got {feature_weights.shape[0]}")
+    self.feature_weights = feature_weights.astype(np.float32)
+    self.feature_bias = feature_bias.astype(np.float32)
+    self.output_weights = output_weights.astype(np.float32)
+    self.output_bias = float(output_bias)
+    self.accumulator = self.feature_bias.copy()
+
+  @classmethod
+  def load(cls, weights_file):
+    with np.load(weights_file) as weights:
+      return cls(weights["feature_weights"], weights["feature_bias"], weights["output_weights"],
+        weights["output_bias"])
+
+  def refresh(self, game_state):
+    features = [feature_index(piece.player_color, piece.type, piece.rank, piece.file)
+      for player in game_state.players.values() for piece in player.all_pieces()]
+    self.accumulator = self.feature_bias + self.feature_weights[features].sum(axis=0)
+
+  def update(self, move, unapply=False):
+    add, subtract = (np.subtract, np.add) if unapply else (np.add, np.subtract)
+    accumulator = self.accumulator
+    color = move.piece.player_color
+    # the piece was still a pawn on its old square if the move promotes
+    old_type = PieceType.PAWN if move.promote_type else move.piece.type
+    subtract(accumulator, self.feature_weights[feature_index(color, old_type, move.old_rank, move.old_file)],
+      out=accumulator)
+    add(accumulator, self.feature_weights[feature_index(color, move.promote_type or move.piece.type, move.rank,
+      move.file)], out=accumulator)
+    if captured_piece := move.captured_piece:
+      subtract(accumulator, self.feature_weights[feature_index(captured_piece.player_color, captured_piece.type,
+        captured_piece.rank, captured_piece.file)], out=accumulator)
+
+  # score for white (take negative for black)
+  def evaluate(self):
+    hidden = np.clip(self.accumulator, 0, ACTIVATION_CLIP)
+    return int(hidden @ self.output_weights + self.output_bias)
@@ -0,0 +1,78 @@
+import math
+import multiprocessing
+import time
+from multiprocessing.sharedctypes import RawArray, RawValue
+
+from enums import PlayerType
+from move import Move
+from transpositions import pack_score, unpack_score
+
+# each helper reports (completed depth, score, move code, moves searched) through its slot of a shared array
+RESULT_FIELDS = 4
+
+
+def helper_search(helper_index, fen, key_history, bonuses_file, nnue_file, search_depth, table_buffer, table_generation,
+    shared_stop, results, max_nodes, deadline):
+  # imported here because game_state imports ai, which imports this module
+  from game_state import GameState
+  # zobrist keys are hashed from scratch, so loading the current fen gives the same keys as the main process, and the
+  # earlier keys are only needed to spot repetitions
+  game_state = GameState(PlayerType.ROBOT, PlayerType.ROBOT, search_depth, bonuses_file, fen, nnue_file=nnue_file,
+    table_buffer=table_buffer)
+  game_state.key_history = key_history
+  ai = game_state.ai
+  ai.transposition_table.generation = table_generation
+  ai.shared_stop = shared_stop
+  ai.print_iterations = False
+  slot = helper_index * RESULT_FIELDS
+
+  def report(depth, move, score):
+    results[slot] = depth
+    results[slot + 1] = pack_score(score)
+    results[slot + 2] = move.encode() if move else 0
+    results[slot + 3] = ai.n_moves_searched
+
+  # odd helpers skip a depth, so the helpers spread out over different iterations instead of repeating each other
+  ai.iterative_deepening(None, max_nodes, deadline, first_depth=1 + helper_index % 2, on_iteration=report)
+  results[slot + 3] = ai.n_moves_searched
+
+
+class LazySMP:
+  def __init__(self, ai, threads):
+    self.ai = ai
+    self.game_state = ai.game_state
+    self.n_helpers = threads - 1
+
+  def search(self, movetime=None, max_nodes=None, deadline=None):
+    movetime = movetime if movetime is not None else self.ai.movetime
+    max_nodes = max_nodes if max_nodes is not None else self.ai.max_nodes
+    # helpers get the same absolute deadline as the main search
+    if movetime is not None:
+      deadline = min(deadline or math.inf, time.time() + movetime)
+    shared_stop = RawValue('b', 0)
+    results = RawArray('q', RESULT_FIELDS * self.n_helpers)
+    fen = self.game_state.generate_fen()
+    helpers = []
+    for helper_index in range(self.n_helpers):
+      helper = multiprocessing.Process(target=helper_search, daemon=True, args=(
+        helper_index, fen, self.game_state.key_history, self.game_state.bonuses_file, self.game_state.nnue_file,
+        self.ai.search_depth, self.ai.transposition_table.buffer, self.ai.transposition_table.generation, shared_stop,
+        results, max_nodes, deadline))
+      helper.start()
+      helpers.append(helper)
+    move, score = self.ai.iterative_deepening(movetime, max_nodes, deadline)
+    shared_stop.value = 1
+    for helper in helpers:
+      helper.join()
+    return self.deepest_result(move, score, results)
+
+  def deepest_result(self, move, score, results):
+    depth = self.ai.completed_depth
+    for helper_index in range(self.n_helpers):
+      slot = helper_index * RESULT_FIELDS
+      helper_depth, helper_score, helper_move_code, helper_n_moves_searched = results[slot:slot + RESULT_FIELDS]
+      self.ai.n_moves_searched += helper_n_moves_searched
+      if helper_depth > depth and helper_move_code:
+        depth, score, move = helper_depth, unpack_score(helper_score), Move.decode(helper_move_code, self.game_state)
+    self.ai.completed_depth = depth
+    return move, score
@@ -0,0 +1,119 @@
+import random
+import time
+from argparse import ArgumentParser
+
+from bitboards import BitboardPosition
+from enums import PlayerType
+from game_state import GameState
+from zobrist import Zobrist
+
+# standard perft positions, with known node counts by depth
+PERFT_POSITIONS = [
+  ("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1", [20, 400, 8902, 197281]),
+  ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", [48, 2039, 97862]),
+  ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238]),
+  ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", [6, 264, 9467]),
+  ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [44, 1486, 62379]),
+]
+
+
+def perft(game_state, active_player_color, depth):
+  moves = game_state.generate_all_legal_moves(active_player_color)
+  if depth == 1:
+    return len(moves)
+  n_positions = 0
+  for move in moves:
+    move.make()
+    n_positions += perft(game_state, active_player_color.opponent, depth - 1)
+    move.unmake()
+  return n_positions
+
+
+def divide(game_state, position, depth):
+  # node counts per root move, keyed by move code, for finding where two generators disagree
+  move_counts = dict()
+  for move in game_state.generate_all_legal_moves(game_state.active_player_color):
+    move.make()
+    move_counts[move.encode()] = perft(game_state, game_state.active_player_color.opponent, depth - 1) \
+      if depth > 1 else 1
+    move.unmake()
+  bitboard_move_counts = dict()
+  for move_code in position.generate_legal_moves():
+    position.make(move_code)
+    bitboard_move_counts[move_code] = position.perft(depth - 1) if depth > 1 else 1
+    position.unmake()
+  return move_counts, bitboard_move_counts
+
+
+def check_position(fen, depth, expected=None):
+  game_state = GameState(PlayerType.HUMAN, PlayerType.HUMAN, fen=fen)
+  position = BitboardPosition(fen)
+  if game_state.generate_fen() != position.generate_fen():
+    print(f"\tfen mismatch: {game_state.generate_fen()} vs {position.generate_fen()}")
+    return False
+  start_time = time.time()
+  n_positions = perft(game_state, game_state.active_player_color, depth)
+  generator_seconds = time.time() - start_time
+  start_time = time.time()
+  n_bitboard_positions = position.perft(depth)
+  bitboard_seconds = time.time() - start_time
+  print(f"\tdepth {depth}: move generator {n_positions} ({generator_seconds:.2f} seconds), "
+    f"bitboards {n_bitboard_positions} ({bitboard_seconds:.2f} seconds)" +
+    (f", expected {expected}" if expected is not None else ""))
+  if n_positions == n_bitboard_positions and expected in (None, n_positions):
+    return True
+  move_counts, bitboard_move_counts = divide(game_state, position, depth)
+  for move_code in sorted(set(move_counts) | set(bitboard_move_counts)):
+    if move_counts.get(move_code) != bitboard_move_counts.get(move_code):
+      print(f"\t\tmove code {move_code}: move generator {move_counts.get(move_code)}, "
+        f"bitboards {bitboard_move_counts.get(move_code)}")
+  return False
+
+
+def check_zobrist_keys(fen, n_plies, rng):
+  # play random moves and take them back, comparing the incremental key with one hashed from scratch at every ply
+  game_state = GameState(PlayerType.HUMAN, PlayerType.HUMAN, fen=fen)
+  played = []
+  for _ in range(n_plies):
+    moves = game_state.generate_all_legal_moves(game_state.active_player_color)
+    if not moves:
+      break
+    move = rng.choice(moves)
+    played.append((move, game_state.board.zobrist_key, game_state.board.pawn_key))
+    move.make()
+    game_state.active_player_color = game_state.active_player_color.opponent
+    if game_state.board.zobrist_key != Zobrist.key_for(game_state) or \
+        game_state.board.pawn_key != Zobrist.pawn_key_for(game_state):
+      print(f"\tkey mismatch after {move.to_uci()}, reaching {game_state.generate_fen()}")
+      return False
+  for move, key, pawn_key in reversed(played):
+    move.unmake()
+    game_state.active_player_color = game_state.active_player_color.opponent
+    if game_state.board.zobrist_key != key or game_state.board.pawn_key != pawn_key:
+      print(f"\tkey not restored after taking back {move.to_uci()}, in {game_state.generate_fen()}")
+      return False
+  print(f"\tzobrist keys consistent over {len(played)} random plies")
+  return True
+
+
+if __name__ == "__main__":
+  parser = ArgumentParser()
+  parser.add_argument("--fen")
+  parser.add_argument("--depth", type=int, default=3)
+  # check incremental zobrist keys over this many random plies per position instead of counting nodes
+  parser.add_argument("--zobrist-plies", type=int)
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+  positions = [(args.fen, [])] if args.fen else PERFT_POSITIONS
+  rng = random.Random(args.seed)
+  n_failures = 0
+  for fen, expected_counts in positions:
+    print(fen)
+    if args.zobrist_plies:
+      passed = check_zobrist_keys(fen, args.zobrist_plies, rng)
+    else:
+      expected = expected_counts[args.depth - 1] if args.depth <= len(expected_counts) else None
+      passed = check_position(fen, args.depth, expected)
+    if not passed:
+      n_failures += 1
+  print(f"\n{len(positions) - n_failures} of {len(positions)} positions match.")
@@ -1,13 +1,16 @@
-from enums import PlayerColor
+from enums import PlayerColor, PieceType
 
 
 class Piece:
+  __slots__ = ['player_color', 'type', 'rank', 'file', 'index']
+
   def __init__(self, player_color, type, rank, file):
     self.player_color = player_color
     self.type = type
     self.rank = rank
     self.file = file
-    self.n_times_moved = 0
+    # slot in the owning player's piece list
+    self.index = None
 
   def __str__(self):
     return f"Piece(player_color={self.player_color}, type={self.type}, rank={self.rank}, file={self.file})"
@@ -27,7 +30,52 @@ class Piece:
     abbr = self.type.value
     return abbr.upper() if self.player_color is PlayerColor.WHITE else abbr
 
-  def update_type(self, new_type, player_pieces):
-    player_pieces[self.type].remove(self)
-    self.type = new_type
-    player_pieces[new_type].add(self)
\ No newline at end of file
+
+class PieceList:
+  # a piece keeps the slot it was first added in, so a capture and its undo are O(1) and iteration order is fixed by
+  # the starting position instead of by set hashing
+  __slots__ = ['slots', 'type_slots', 'type_counts', 'king']
+
+  def __init__(self):
+    self.slots = []
+    # slot indices holding each piece type, in slot order, so looking up one type doesn't scan every piece. a tuple is
+    # replaced rather than changed, so a promotion made during iteration doesn't disturb it
+    self.type_slots = dict((piece_type, ()) for piece_type in PieceType)
+    self.type_counts = dict((piece_type, 0) for piece_type in PieceType)
+    self.king = None
+
+  def __iter__(self):
+    for piece in self.slots:
+      if piece is not None:
+        yield piece
+
+  def add(self, piece):
+    if piece.index is None:
+      piece.index = len(self.slots)
+      self.slots.append(piece)
+      self.type_slots[piece.type] += (piece.index,)
+    else:
+      self.slots[piece.index] = piece
+    self.type_counts[piece.type] += 1
+    if piece.type is PieceType.KING:
+      self.king = piece
+
+  def remove(self, piece):
+    self.slots[piece.index] = None
+    self.type_counts[piece.type] -= 1
+
+  def update_type(self, piece, new_type):
+    self.type_counts[piece.type] -= 1
+    self.type_slots[piece.type] = tuple(index for index in self.type_slots[piece.type] if index != piece.index)
+    piece.type = new_type
+    self.type_counts[new_type] += 1
+    self.type_slots[new_type] = tuple(sorted(self.type_slots[new_type] + (piece.index,)))
+
+  def of_type(self, piece_type):
+    slots = self.slots
+    for index in self.type_slots[piece_type]:
+      if slots[index] is not None:
+        yield slots[index]
+
+  def count(self, piece_type):
+    return self.type_counts[piece_type]
@@ -1,7 +1,6 @@
-from collections import defaultdict
-
 from attack_board import AttackBoard
 from enums import PieceType
+from piece import PieceList
 
 
 class PlayerState:
@@ -9,32 +8,20 @@ class PlayerState:
     self.player_color = player_color
     self.player_type = player_type
     self.game_state = game_state
-    self.pieces = defaultdict(set)
+    self.pieces = PieceList()
     self.legal_moves = []
     self.attack_board = AttackBoard(self)
 
   def in_check(self):
-    king = self.find(PieceType.KING)
-    return self.game_state.players[self.player_color.opponent].attack_board[king.rank][king.file]
-
-  def find_castling_rook(self, king_side):
-    for rook in self.pieces[PieceType.ROOK]:
-      if king_side:
-        if rook.file == 7:
-          return rook
-      else:
-        if rook.file == 0:
-          return rook
-    return None
+    return self.game_state.board.bitboards.in_check(self.player_color)
 
   def find(self, piece_type):
-    piece_set = self.find_all(piece_type)
-    if not piece_set:
-      return None
-    return next(iter(piece_set))
+    if piece_type is PieceType.KING:
+      return self.pieces.king
+    return next(self.find_all(piece_type), None)
 
   def find_all(self, piece_type):
-    return self.pieces[piece_type]
+    return self.pieces.of_type(piece_type)
 
   def opponent(self):
     return self.game_state.players[self.player_color.opponent]
@@ -45,5 +32,8 @@ class PlayerState:
   def refresh_attack_board(self):
     self.attack_board.refresh()
 
+  def update_attack_board(self, move):
+    self.attack_board.update(move)
+
   def all_pieces(self):
-    return [piece for piece_type in PieceType for piece in self.pieces[piece_type]]
\ No newline at end of file
+    return iter(self.pieces)
\ No newline at end of file
@@ -1,4 +1,22 @@
+from array import array
 from enum import Enum
+from multiprocessing.sharedctypes import RawArray
+
+from core import MATE_THRESHOLD
+from move import Move
+
+DEFAULT_TABLE_MB = 16
+# each entry is two 64-bit words, (zobrist key ^ data, data), so a torn write from another process just looks like a
+# key mismatch instead of a corrupted entry
+ENTRY_WORDS = 2
+ENTRY_BYTES = 8 * ENTRY_WORDS
+# entries sharing an index: the first ones keep the deepest results, the last one always takes the newest result
+BUCKET_SIZE = 4
+DEPTH_PREFERRED_SLOTS = BUCKET_SIZE - 1
+N_GENERATIONS = 1 << 6
+SCORE_OFFSET = 1 << 31
+# scores are stored in 32 bits
+MAX_STORED_SCORE = SCORE_OFFSET - 1
 
 
 class EvalType(Enum):
@@ -7,43 +25,165 @@ class EvalType(Enum):
   UPPER_BOUND = 3
 
 
+EVAL_TYPES_BY_VALUE = dict((eval_type.value, eval_type) for eval_type in EvalType)
+
+
+def pack_score(score):
+  return max(-MAX_STORED_SCORE, min(MAX_STORED_SCORE, int(score))) + SCORE_OFFSET
+
+
+def unpack_score(packed_score):
+  return packed_score - SCORE_OFFSET
+
+
+def score_to_table(score, ply):
+  # mate scores count plies from the root, but the same position can come up at any ply, so store them counted from
+  # the position itself
+  if score >= MATE_THRESHOLD:
+    return score + ply
+  if score <= -MATE_THRESHOLD:
+    return score - ply
+  return score
+
+
+def score_from_table(score, ply):
+  if score >= MATE_THRESHOLD:
+    return score - ply
+  if score <= -MATE_THRESHOLD:
+    return score + ply
+  return score
+
+
+# data layout, from the low bits: score (32), depth (8), eval type (2), move code (16), generation (6)
+def pack_entry(depth, score, eval_type, move_code, generation):
+  return pack_score(score) | (min(max(depth, 0), 0xff) << 32) | (eval_type.value << 40) | (move_code << 42) | \
+         (generation << 58)
+
+
+def entry_depth(data):
+  return (data >> 32) & 0xff
+
+
+def entry_generation(data):
+  return data >> 58
+
+
 class TranspositionEntry:
-  def __init__(self, zobrist_key, depth, score, eval_type, move):
+  def __init__(self, zobrist_key, data, game_state):
     self.zobrist_key = zobrist_key
-    self.depth = depth
-    self.score = score
-    self.eval_type = eval_type
-    self.move = move
+    self.depth = entry_depth(data)
+    self.score = unpack_score(data & 0xffffffff)
+    self.eval_type = EVAL_TYPES_BY_VALUE[(data >> 40) & 0x3]
+    self.move_code = (data >> 42) & 0xffff
+    self.game_state = game_state
+    self._move = None
+
+  @property
+  def move(self):
+    # only decode the move against the current position when someone actually asks for it
+    if self._move is None and self.move_code:
+      self._move = Move.decode(self.move_code, self.game_state)
+    return self._move
+
+  def matches_move(self, move):
+    return self.move_code == move.encode()
 
 
 class TranspositionTable:
-  def __init__(self):
-    self.entries = dict()
+  def __init__(self, game_state, size_mb=DEFAULT_TABLE_MB, buffer=None, generation=0):
+    self.game_state = game_state
+    self.buffer = buffer if buffer is not None else self.allocate(size_mb)
+    self.n_buckets = len(self.buffer) // (ENTRY_WORDS * BUCKET_SIZE)
+    # bumped for every new search, so entries left over from older searches get replaced first
+    self.generation = generation
     self.n_transpositions_evaluated = 0
 
-  def store(self, zobrist_key, depth, score, eval_type, move):
-    self.entries[zobrist_key] = TranspositionEntry(zobrist_key, depth, score, eval_type, move)
+  def allocate(self, size_mb):
+    n_entries = size_mb * (1 << 20) // ENTRY_BYTES
+    return array('Q', bytes(n_entries * ENTRY_BYTES))
+
+  def new_search(self):
+    self.generation = (self.generation + 1) % N_GENERATIONS
+
+  def bucket_index(self, zobrist_key):
+    return (zobrist_key % self.n_buckets) * BUCKET_SIZE * ENTRY_WORDS
+
+  def read(self, zobrist_key):
+    index = self.bucket_index(zobrist_key)
+    for entry_index in range(index, index + BUCKET_SIZE * ENTRY_WORDS, ENTRY_WORDS):
+      data = self.buffer[entry_index + 1]
+      if self.buffer[entry_index] ^ data == zobrist_key:
+        return data
+    return None
+
+  def replacement_index(self, zobrist_key, depth):
+    index = self.bucket_index(zobrist_key)
+    always_replace_index = index + DEPTH_PREFERRED_SLOTS * ENTRY_WORDS
+    for entry_index in range(index, always_replace_index, ENTRY_WORDS):
+      data = self.buffer[entry_index + 1]
+      if self.buffer[entry_index] ^ data == zobrist_key:
+        # same position: only overwrite it with a deeper (or newer) result, and keep a shallower one next to it
+        if depth >= entry_depth(data) or entry_generation(data) != self.generation:
+          return entry_index
+        return always_replace_index
+    if self.buffer[always_replace_index] ^ self.buffer[always_replace_index + 1] == zobrist_key:
+      # a position only held in the always-replace slot is updated there, so the bucket never holds it twice
+      return always_replace_index
+    best_index, best_value = None, None
+    for entry_index in range(index, always_replace_index, ENTRY_WORDS):
+      data = self.buffer[entry_index + 1]
+      # empty and stale slots go first, then the shallowest result
+      value = -1 if not data or entry_generation(data) != self.generation else entry_depth(data)
+      if value <= depth and (best_value is None or value < best_value):
+        best_index, best_value = entry_index, value
+    if best_index is not None:
+      return best_index
+    return always_replace_index
 
-  def lookup(self, zobrist_key, depth, alpha, beta):
-    if zobrist_key not in self.entries:
+  def store(self, zobrist_key, depth, score, eval_type, move, ply=0):
+    entry_index = self.replacement_index(zobrist_key, depth)
+    if move:
+      move_code = move.encode()
+    else:
+      # a bound without a best move keeps the move we already had for this position, so ordering doesn't lose it
+      old_data = self.read(zobrist_key)
+      move_code = (old_data >> 42) & 0xffff if old_data is not None else 0
+    data = pack_entry(depth, score_to_table(score, ply), eval_type, move_code, self.generation)
+    self.buffer[entry_index] = zobrist_key ^ data
+    self.buffer[entry_index + 1] = data
+
+  def from_key(self, zobrist_key):
+    data = self.read(zobrist_key)
+    if data is None:
       return None
-    entry = self.entries[zobrist_key]
-    if entry.depth < depth:
+    return TranspositionEntry(zobrist_key, data, self.game_state)
+
+  def lookup(self, zobrist_key, depth, alpha, beta, ply=0):
+    entry = self.from_key(zobrist_key)
+    if not entry or entry.depth < depth:
       return None
+    entry.score = score_from_table(entry.score, ply)
     if entry.eval_type is EvalType.EXACT:
       self.n_transpositions_evaluated += 1
-      # print(f"found exact score in tranposition table: {entry.score}")
       return entry
     elif entry.eval_type is EvalType.UPPER_BOUND and entry.score <= alpha:
       self.n_transpositions_evaluated += 1
-      # print(f"found upper bound score in tranposition table: {entry.score}")
       return entry
     elif entry.eval_type is EvalType.LOWER_BOUND and entry.score >= beta:
       self.n_transpositions_evaluated += 1
-      # print(f"found lower bound score in tranposition table: {entry.score}")
       return entry
     else:
       return None
 
-  def from_key(self, zobrist_key):
-    return self.entries.get(zobrist_key, None)
\ No newline at end of file
+  def usage(self):
+    # permille of a sample of entries written by the current search
+    n_sampled = min(1000, len(self.buffer) // ENTRY_WORDS)
+    n_used = sum(1 for entry_index in range(0, n_sampled * ENTRY_WORDS, ENTRY_WORDS)
+      if self.buffer[entry_index + 1] and entry_generation(self.buffer[entry_index + 1]) == self.generation)
+    return 1000 * n_used // n_sampled
+
+
+class SharedTranspositionTable(TranspositionTable):
+  def allocate(self, size_mb):
+    # shared memory, so every search process that's handed the buffer reads and writes the same table
+    return RawArray('Q', size_mb * (1 << 20) // 8)
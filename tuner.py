@@ -0,0 +1,244 @@
+import os
+import re
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from board import Board, MIDGAME, ENDGAME, MAX_PHASE
+from book_processor import parse_move
+from enums import PlayerColor, PieceType, PlayerType
+from game_state import GameState
+
+# game results from white's point of view
+RESULT_SCORES = {"1-0": 1.0, "1/2-1/2": 0.5, "0-1": 0.0}
+# book moves and early development say little about evaluation
+OPENING_PLIES = 10
+# parameters: midgame and endgame square bonuses for each piece type, then material values
+PIECE_TYPES = list(PieceType)
+N_SQUARE_PARAMS = len(PIECE_TYPES) * 64
+MATERIAL_OFFSET = 2 * N_SQUARE_PARAMS
+N_PARAMS = MATERIAL_OFFSET + len(PIECE_TYPES)
+
+
+def read_games(pgn_file):
+  # (result, movetext) for each game
+  result, movetext = None, []
+  # older pgn files are often latin-1 rather than utf-8
+  with open(pgn_file, "r", encoding="latin-1") as f:
+    for line in f:
+      text = line.strip()
+      if text.startswith("["):
+        if movetext:
+          yield result, " ".join(movetext)
+          movetext = []
+        if match := re.match(r'\[Result "(.*)"\]', text):
+          result = match.group(1)
+      elif text:
+        movetext.append(text)
+  if movetext:
+    yield result, " ".join(movetext)
+
+
+def san_moves(movetext):
+  # drop comments, move numbers, annotations and the result
+  tokens = re.sub(r"\{[^}]*\}|\d+\.+", " ", movetext).split()
+  return [token for token in tokens if token not in RESULT_SCORES and token != "*" and not token.startswith("$")]
+
+
+def square_param(piece_type, player_color, rank, file):
+  # square bonus tables are written with the opponent's back rank first, from black's point of view
+  row = 7 - rank if player_color is PlayerColor.WHITE else rank
+  return PIECE_TYPES.index(piece_type) * 64 + row * 8 + file
+
+
+def position_features(game_state):
+  # the evaluation is linear in the parameters, so a position is just the parameter indices it touches and the
+  # coefficient of each: square bonuses signed by color and weighted by game phase, and material by count difference
+  phase = min(game_state.board.phase, MAX_PHASE)
+  indices, coefficients = [], []
+  for player in game_state.players.values():
+    sign = 1 if player.player_color is PlayerColor.WHITE else -1
+    for piece in player.all_pieces():
+      square = square_param(piece.type, piece.player_color, piece.rank, piece.file)
+      indices.extend([square, N_SQUARE_PARAMS + square])
+      coefficients.extend([sign * phase / MAX_PHASE, sign * (MAX_PHASE - phase) / MAX_PHASE])
+  white_pieces, black_pieces = game_state.players[PlayerColor.WHITE].pieces, game_state.players[PlayerColor.BLACK].pieces
+  for type_index, piece_type in enumerate(PIECE_TYPES):
+    if count := white_pieces.count(piece_type) - black_pieces.count(piece_type):
+      indices.append(MATERIAL_OFFSET + type_index)
+      coefficients.append(count)
+  return indices, coefficients
+
+
+def extract_positions(pgn_file, limit=None):
+  # quiet positions from each game: not in check, and neither reached by nor followed by a capture. features of all
+  # positions are stored back to back, with the offset where each position's features start
+  indices, coefficients, starts, results = [], [], [], []
+  n_games, skipped_games = 0, 0
+  start_time = time.time()
+  for result, movetext in read_games(pgn_file):
+    if result not in RESULT_SCORES:
+      continue
+    if limit is not None and n_games >= limit:
+      break
+    n_games += 1
+    game_state = GameState(PlayerType.HUMAN, PlayerType.HUMAN)
+    last_move_captured = False
+    try:
+      for ply, move_string in enumerate(san_moves(movetext)):
+        move = parse_move(move_string, game_state)
+        if ply >= OPENING_PLIES and not last_move_captured and not move.captured_piece and \
+            not game_state.active_player().in_check():
+          position_indices, position_coefficients = position_features(game_state)
+          starts.append(len(indices))
+          indices.extend(position_indices)
+          coefficients.extend(position_coefficients)
+          results.append(RESULT_SCORES[result])
+        move.make()
+        game_state.active_player_color = game_state.active_player_color.opponent
+        last_move_captured = move.captured_piece is not None or move.promote_type is not None
+    except Exception as e:
+      print(f"skipping rest of game #{n_games}: {e}")
+      skipped_games += 1
+    if n_games % 100 == 0:
+      print(f"{n_games} games, {len(results)} positions, in {time.time() - start_time:.1f} seconds")
+  print(f"extracted {len(results)} positions from {n_games} games ({skipped_games} cut short)")
+  return Positions(np.array(indices, dtype=np.int32), np.array(coefficients, dtype=np.float32),
+    np.array(starts, dtype=np.int64), np.array(results, dtype=np.float32))
+
+
+class Positions:
+  def __init__(self, indices, coefficients, starts, results):
+    self.indices = indices
+    self.coefficients = coefficients
+    self.starts = starts
+    self.results = results
+    # position of each feature, to spread per-position gradients back over features
+    self.rows = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(indices))))
+
+  @classmethod
+  def load(cls, positions_file):
+    with np.load(positions_file) as positions:
+      return cls(positions["indices"], positions["coefficients"], positions["starts"], positions["results"])
+
+  def save(self, positions_file):
+    np.savez_compressed(positions_file, indices=self.indices, coefficients=self.coefficients, starts=self.starts,
+      results=self.results)
+
+  def evaluate(self, params):
+    # only material and square bonuses: the pawn structure terms in evaluation.py are left out of the fit, so the
+    # tuned tables partly absorb them
+    # every position has kings, so none of them has an empty run of features
+    return np.add.reduceat(params[self.indices] * self.coefficients, self.starts)
+
+  def gradient(self, score_gradients):
+    return np.bincount(self.indices, weights=self.coefficients * score_gradients[self.rows], minlength=N_PARAMS)
+
+
+def initial_params(bonuses_file):
+  params = np.zeros(N_PARAMS, dtype=np.float64)
+  bonuses = Board(None, None).read_square_bonuses(bonuses_file) if bonuses_file else None
+  for type_index, piece_type in enumerate(PIECE_TYPES):
+    params[MATERIAL_OFFSET + type_index] = piece_type.score
+    if bonuses:
+      for phase, offset in [(MIDGAME, 0), (ENDGAME, N_SQUARE_PARAMS)]:
+        start = offset + type_index * 64
+        params[start:start + 64] = np.array(bonuses[piece_type][phase][PlayerColor.BLACK]).ravel()
+  return params
+
+
+def sigmoid(scores, k):
+  return 1 / (1 + np.exp(-k * scores))
+
+
+def mean_squared_error(params, positions, k):
+  return float(np.mean((positions.results - sigmoid(positions.evaluate(params), k)) ** 2))
+
+
+def fit_scaling(params, positions):
+  # the texel method first picks the sigmoid scaling that best fits the starting evaluation, then keeps it fixed
+  scores, results = positions.evaluate(params), positions.results
+  low, high = 0.0001, 0.02
+  for _ in range(50):
+    k1, k2 = low + (high - low) / 3, high - (high - low) / 3
+    if np.mean((results - sigmoid(scores, k1)) ** 2) < np.mean((results - sigmoid(scores, k2)) ** 2):
+      high = k2
+    else:
+      low = k1
+  return (low + high) / 2
+
+
+def tune(params, positions, k, n_epochs, learning_rate, regularization):
+  # full-batch adam over all positions at once. the regularization term pulls parameters back toward their starting
+  # values, so squares that hardly ever hold a given piece don't drift off on a handful of games
+  results = positions.results
+  initial = params.copy()
+  first_moment = np.zeros_like(params)
+  second_moment = np.zeros_like(params)
+  beta1, beta2, epsilon = 0.9, 0.999, 1e-8
+  # the king's material value is a constant, since both sides always have one
+  king_material = MATERIAL_OFFSET + PIECE_TYPES.index(PieceType.KING)
+  for epoch in range(1, n_epochs + 1):
+    predictions = sigmoid(positions.evaluate(params), k)
+    # derivative of the mean squared error with respect to each position's score
+    score_gradients = -2 * k * (results - predictions) * predictions * (1 - predictions) / len(results)
+    gradient = positions.gradient(score_gradients) + 2 * regularization * (params - initial)
+    gradient[king_material] = 0
+    first_moment = beta1 * first_moment + (1 - beta1) * gradient
+    second_moment = beta2 * second_moment + (1 - beta2) * gradient ** 2
+    params -= learning_rate * (first_moment / (1 - beta1 ** epoch)) / \
+      (np.sqrt(second_moment / (1 - beta2 ** epoch)) + epsilon)
+    if epoch % 100 == 0 or epoch == n_epochs:
+      print(f"epoch {epoch}: error {mean_squared_error(params, positions, k):.6f}")
+  return params
+
+
+def write_bonuses(params, output_file):
+  # material is fixed by PieceType.score, so any tuned difference is folded into every square of the piece's tables
+  with open(output_file, "w") as f:
+    for type_index, piece_type in enumerate(PIECE_TYPES):
+      material_change = params[MATERIAL_OFFSET + type_index] - piece_type.score
+      for phase_name, offset in [("midgame", 0), ("endgame", N_SQUARE_PARAMS)]:
+        start = offset + type_index * 64
+        table = np.rint(params[start:start + 64] + material_change).astype(int).reshape(8, 8)
+        f.write(f"{piece_type.value} {phase_name}\n")
+        for row in table:
+          f.write(",".join(f"{value:3d}" for value in row).strip() + "\n")
+        f.write("\n")
+
+
+if __name__ == "__main__":
+  parser = ArgumentParser()
+  parser.add_argument("pgn_file")
+  parser.add_argument("--output-file", default="resources/tuned_square_bonuses.txt")
+  # starting square bonuses, zero if not given
+  parser.add_argument("--square-bonuses-file", default="resources/piece_square_bonuses.txt")
+  # extracted positions are saved here and reused on later runs, since parsing the games is the slow part
+  parser.add_argument("--positions-file")
+  parser.add_argument("--limit", type=int)
+  parser.add_argument("--epochs", type=int, default=2000)
+  # adam steps are about learning-rate centipawns each, and the regularization keeps rarely seen squares close to
+  # their starting values, so the tables stay usable rather than just fitting these games
+  parser.add_argument("--learning-rate", type=float, default=0.1)
+  parser.add_argument("--regularization", type=float, default=1e-6)
+  args = parser.parse_args()
+  start_time = time.time()
+  if args.positions_file and os.path.exists(args.positions_file):
+    positions = Positions.load(args.positions_file)
+  else:
+    positions = extract_positions(args.pgn_file, args.limit)
+    if args.positions_file:
+      positions.save(args.positions_file)
+  print(f"\nloaded {len(positions.results)} positions in {time.time() - start_time:.1f} seconds")
+  params = initial_params(args.square_bonuses_file)
+  k = fit_scaling(params, positions)
+  print(f"sigmoid scaling: {k:.6f}, starting error: {mean_squared_error(params, positions, k):.6f}")
+  tune_start_time = time.time()
+  params = tune(params, positions, k, args.epochs, args.learning_rate, args.regularization)
+  print(f"\ntuned in {time.time() - tune_start_time:.1f} seconds")
+  for type_index, piece_type in enumerate(PIECE_TYPES):
+    print(f"\t{piece_type.value}: material {params[MATERIAL_OFFSET + type_index]:.0f} (was {piece_type.score})")
+  write_bonuses(params, args.output_file)
+  print(f"wrote {args.output_file}")
+  print(f"\n--- COMPLETED IN {time.time() - start_time:.1f} SECONDS ---")
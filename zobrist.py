@@ -20,17 +20,26 @@ class Zobrist:
   en_passant_file = [random_64bits() for _ in range(9)]
 
   @classmethod
-  def init_key(cls):
+  def key_for(cls, game_state):
+    # hash the position from scratch, so a game set up from a fen gets the key it would have reached by moves
     key = 0
-    for color in PlayerColor:
-      for piece_type in PieceType:
-        for rank in range(8):
-          for file in range(8):
-            key ^= cls.pieces[color][piece_type][rank][file]
-    for v in cls.castling_rights:
-      key ^= v
-    for v in cls.en_passant_file:
-      key ^= v
+    for rank in range(8):
+      for file in range(8):
+        if piece := game_state.board[rank][file]:
+          key ^= cls.get_piece_hash(piece, rank, file)
+    if game_state.active_player_color is PlayerColor.BLACK:
+      key ^= cls.black_to_move
+    key ^= cls.castling_rights[game_state.castling_rights]
+    key ^= cls.en_passant_file[game_state.en_passant_file]
+    return key
+
+  @classmethod
+  def pawn_key_for(cls, game_state):
+    # pawns only, so positions with the same pawn structure share pawn table entries
+    key = 0
+    for player in game_state.players.values():
+      for pawn in player.find_all(PieceType.PAWN):
+        key ^= cls.get_piece_hash(pawn, pawn.rank, pawn.file)
     return key
 
   @classmethod
@@ -38,37 +47,42 @@ class Zobrist:
     return cls.pieces[piece.player_color][piece.type][rank][file]
 
   @classmethod
-  def update_key(cls, original_key, move):
+  def update_key(cls, original_key, move, pieces_only=False):
     key = original_key
-    # remove old piece position
-    key ^= Zobrist.get_piece_hash(move.piece, move.old_rank, move.old_file)
+    color = move.piece.player_color
+    # remove old piece position, which was still a pawn if the move promotes
+    key ^= Zobrist.pieces[color][PieceType.PAWN if move.promote_type else move.piece.type][move.old_rank][move.old_file]
     if move.captured_piece:
       # remove captured piece
       key ^= Zobrist.get_piece_hash(move.captured_piece, move.captured_piece.rank, move.captured_piece.file)
     # add new piece position
-    key ^= Zobrist.get_piece_hash(move.piece, move.rank, move.file)
+    key ^= Zobrist.pieces[color][move.promote_type or move.piece.type][move.rank][move.file]
+    if pieces_only:
+      # the rook half of castling, the king move accounts for everything else
+      return key
     key ^= Zobrist.black_to_move
-    key ^= Zobrist.en_passant_file_hash(move.previous_en_passant_target_square)
-    key ^= Zobrist.en_passant_file_hash(move.en_passant_target_square)
-    key ^= Zobrist.castling_hash(move.original_castling_fen)
-    key ^= Zobrist.castling_hash(move.castling_fen_after_move)
+    key ^= Zobrist.en_passant_file[move.previous_en_passant_file]
+    key ^= Zobrist.en_passant_file[move.en_passant_file]
+    key ^= Zobrist.castling_rights[move.previous_castling_rights]
+    key ^= Zobrist.castling_rights[move.castling_rights]
     return key
 
   @classmethod
-  def en_passant_file_hash(cls, square):
-    return Zobrist.en_passant_file[square[1]] if square is not None else \
-      Zobrist.en_passant_file[EN_PASSANT_DISALLOWED_INDEX]
+  def update_pawn_key(cls, original_key, move):
+    key = original_key
+    color = move.piece.player_color
+    if move.promote_type or move.piece.type is PieceType.PAWN:
+      key ^= Zobrist.pieces[color][PieceType.PAWN][move.old_rank][move.old_file]
+      if not move.promote_type:
+        key ^= Zobrist.pieces[color][PieceType.PAWN][move.rank][move.file]
+    if move.captured_piece and move.captured_piece.type is PieceType.PAWN:
+      key ^= Zobrist.get_piece_hash(move.captured_piece, move.captured_piece.rank, move.captured_piece.file)
+    return key
 
   @classmethod
-  def castling_hash(cls, castle_fen):
-    if castle_fen == "-":
-      return Zobrist.castling_rights[0]
-    fen_index = 0
-    result = 0
-    for right_index, right in enumerate("KQkq"):
-      if castle_fen[fen_index] == right:
-        result += 2 ** right_index
-        fen_index += 1
-        if fen_index == len(castle_fen):
-          return Zobrist.castling_rights[result]
-    return Zobrist.castling_rights[result]
+  def update_null_move_key(cls, original_key, previous_en_passant_file):
+    # passing the move flips the side to move and clears any en passant target
+    key = original_key ^ Zobrist.black_to_move
+    key ^= Zobrist.en_passant_file[previous_en_passant_file]
+    key ^= Zobrist.en_passant_file[EN_PASSANT_DISALLOWED_INDEX]
+    return key